@@ -3,33 +3,46 @@
 # See LICENSE file for licensing details.
 
 import logging
+import time
+from functools import cached_property
+from pathlib import Path
 
 import lightkube
-from charmed_kubeflow_chisme.components import (
-    CharmReconciler,
-    LazyContainerFileTemplate,
-    LeadershipGateComponent,
-)
-from charmed_kubeflow_chisme.components.kubernetes_component import KubernetesComponent
+from charmed_kubeflow_chisme.components import CharmReconciler, LazyContainerFileTemplate
 from charmed_kubeflow_chisme.kubernetes import create_charm_default_labels
 from charms.loki_k8s.v1.loki_push_api import LogForwarder
 from charms.mlops_libs.v0.k8s_service_info import KubernetesServiceInfoProvider
-from charms.observability_libs.v1.kubernetes_service_patch import KubernetesServicePatch
 from charms.velero_libs.v0.velero_backup_config import VeleroBackupProvider, VeleroBackupSpec
-from lightkube.models.core_v1 import ServicePort
 from lightkube.resources.core_v1 import Service
-from ops import main
-from ops.charm import CharmBase
+from ops import ActiveStatus, main
+from ops.charm import ActionEvent, CharmBase
 
+from components.database_components import DatabaseRequirerComponent
+from components.endpoints_components import UnitEndpointsProviderComponent
+from components.gate_components import WorkloadGateComponent
+from components.kubernetes_components import MlmdKubernetesComponent
 from components.pebble_components import MlmdPebbleService
+from components.sqlite_components import SqliteStoreComponent, SqliteStoreError
+from components.velero_components import VeleroBackupHooksComponent
 
 logger = logging.getLogger()
 
 GRPC_SVC_NAME = "metadata-grpc-service"
-K8S_RESOURCE_FILES = ["src/templates/ml-pipeline-service.yaml.j2"]
+K8S_RESOURCE_FILES = [
+    "src/templates/app-service.yaml.j2",
+    "src/templates/ml-pipeline-service.yaml.j2",
+]
+PEER_RELATION_NAME = "mlmd-peers"
 RELATION_NAME = "grpc"
-SQLITE_CONFIG_PROTO_DESTINATION = "/config/config.proto"
-SQLITE_CONFIG_PROTO = 'connection_config: {sqlite: {filename_uri: "file:/data/mlmd.db"}}'
+CONFIG_PROTO_DESTINATION = "/config/config.proto"
+CONFIG_PROTO_TEMPLATE = "src/templates/config.proto.j2"
+DATABASE_NAME = "metadb"
+MYSQL_RELATION_NAME = "mysql-db"
+POSTGRESQL_RELATION_NAME = "postgresql-db"
+SQLITE_DATABASE_FILE = "mlmd.db"
+# User of the workload image, with the uid and gid of the container in metadata.yaml
+WORKLOAD_USER = "_daemon_"
+STORAGE_NAME = "mlmd-data"
 
 
 class Operator(CharmBase):
@@ -42,16 +55,22 @@ class Operator(CharmBase):
         self.charm_reconciler = CharmReconciler(self)
         self._svc_grpc_port = self.config["port"]
 
-        self.leadership_gate = self.charm_reconciler.add(
-            component=LeadershipGateComponent(
+        # Non-leader units only run the workload when an external database is related; the
+        # Kubernetes resources are always managed by the leader only
+        self.workload_gate = self.charm_reconciler.add(
+            component=WorkloadGateComponent(
                 charm=self,
-                name="leadership-gate",
+                name="workload-gate",
+                run_on_all_units=lambda: (
+                    self.mysql_database.component.is_related
+                    or self.postgresql_database.component.is_related
+                ),
             ),
             depends_on=[],
         )
 
         self.kubernetes_resources = self.charm_reconciler.add(
-            component=KubernetesComponent(
+            component=MlmdKubernetesComponent(
                 charm=self,
                 name="kubernetes:svc",
                 resource_templates=K8S_RESOURCE_FILES,
@@ -63,10 +82,33 @@ class Operator(CharmBase):
                     "app_name": self.app.name,
                     "namespace": self.model.name,
                     "grpc_port": self._svc_grpc_port,
+                    "headless": self.config["headless-service"],
                 },
-                lightkube_client=lightkube.Client(),
+                lightkube_client_getter=lambda: self.lightkube_client,
+            ),
+            depends_on=[self.workload_gate],
+        )
+
+        self.mysql_database = self.charm_reconciler.add(
+            component=DatabaseRequirerComponent(
+                charm=self,
+                name="relation:mysql-db",
+                relation_name=MYSQL_RELATION_NAME,
+                database_name=DATABASE_NAME,
+                conflicting_relations=[POSTGRESQL_RELATION_NAME],
             ),
-            depends_on=[self.leadership_gate],
+            depends_on=[self.workload_gate],
+        )
+
+        self.postgresql_database = self.charm_reconciler.add(
+            component=DatabaseRequirerComponent(
+                charm=self,
+                name="relation:postgresql-db",
+                relation_name=POSTGRESQL_RELATION_NAME,
+                database_name=DATABASE_NAME,
+                conflicting_relations=[MYSQL_RELATION_NAME],
+            ),
+            depends_on=[self.workload_gate],
         )
 
         self.mlmd_container = self.charm_reconciler.add(
@@ -76,20 +118,75 @@ class Operator(CharmBase):
                 container_name="mlmd-grpc-server",
                 service_name="mlmd",
                 grpc_port=self._svc_grpc_port,
-                metadata_store_server_config_file=SQLITE_CONFIG_PROTO_DESTINATION,
+                grpc_channel_args=self.config["grpc-channel-args"],
+                backoff_delay=self.config["restart-backoff-delay"],
+                backoff_factor=self.config["restart-backoff-factor"],
+                backoff_limit=self.config["restart-backoff-limit"],
+                # Units sharing an external database would otherwise migrate its schema
+                # concurrently on a refresh, so only the leader does
+                enable_database_upgrade=lambda: self.unit.is_leader(),
+                metadata_store_server_config_file=CONFIG_PROTO_DESTINATION,
                 files_to_push=[
                     LazyContainerFileTemplate(
-                        destination_path=SQLITE_CONFIG_PROTO_DESTINATION,
-                        source_template=SQLITE_CONFIG_PROTO,
+                        destination_path=CONFIG_PROTO_DESTINATION,
+                        source_template_path=CONFIG_PROTO_TEMPLATE,
+                        # The file holds the database credentials
+                        user=WORKLOAD_USER,
+                        group=WORKLOAD_USER,
+                        permissions=0o600,
+                        context=lambda: {
+                            "mysql": self.mysql_database.component.get_data(),
+                            "postgresql": self.postgresql_database.component.get_data(),
+                        },
                     )
                 ],
             ),
-            depends_on=[self.leadership_gate],
+            depends_on=[self.workload_gate, self.mysql_database, self.postgresql_database],
+        )
+
+        self.sqlite_store = self.charm_reconciler.add(
+            component=SqliteStoreComponent(
+                charm=self,
+                name="sqlite-store",
+                storage_name=STORAGE_NAME,
+                database_file=SQLITE_DATABASE_FILE,
+                container_name="mlmd-grpc-server",
+                workload_user=WORKLOAD_USER,
+                journal_mode=self.config["sqlite-journal-mode"],
+                maintenance_window=self.config["sqlite-maintenance-window"],
+                retention_days=self.config["sqlite-retention-days"],
+                enabled=lambda: not self.workload_gate.component.run_on_all_units,
+            ),
+            depends_on=[self.mlmd_container],
+        )
+
+        self.velero_backup_hooks = self.charm_reconciler.add(
+            component=VeleroBackupHooksComponent(
+                charm=self,
+                name="velero-backup-hooks",
+                container_name="charm",
+                command=self.sqlite_store.component.get_checkpoint_command,
+                timeout="30s",
+                lightkube_client_getter=lambda: self.lightkube_client,
+            ),
+            depends_on=[self.sqlite_store],
+        )
+
+        self.grpc_endpoints = self.charm_reconciler.add(
+            component=UnitEndpointsProviderComponent(
+                charm=self,
+                name="relation:grpc-endpoints",
+                relation_name=RELATION_NAME,
+                peer_relation_name=PEER_RELATION_NAME,
+                port=self._svc_grpc_port,
+                enabled=lambda: self.config["headless-service"],
+                run_on_all_units=lambda: self.workload_gate.component.run_on_all_units,
+                workload_ready=lambda: isinstance(self.mlmd_container.status, ActiveStatus),
+            ),
+            depends_on=[],
         )
 
         self.charm_reconciler.install_default_event_handlers()
-        grpc_port = ServicePort(int(self._svc_grpc_port), name="grpc-api")
-        self.service_patcher = KubernetesServicePatch(self, [grpc_port])
 
         # KubernetesServiceInfoProvider for broadcasting the GRPC service information
         self._k8s_svc_info_provider = KubernetesServiceInfoProvider(
@@ -104,9 +201,11 @@ class Operator(CharmBase):
         self.velero_backup_config = VeleroBackupProvider(
             charm=self,
             relation_name="velero-backup-config",
+            # Velero only runs the pre-backup hooks of the pods it backs up, so the pods are
+            # included.  Juju re-creates them from its StatefulSet, so restores exclude them.
             spec=VeleroBackupSpec(
                 include_namespaces=[self.model.name],
-                include_resources=["persistentvolumeclaims", "persistentvolumes"],
+                include_resources=["persistentvolumeclaims", "persistentvolumes", "pods"],
                 label_selector={
                     "app.kubernetes.io/name": self.app.name,
                 },
@@ -115,6 +214,67 @@ class Operator(CharmBase):
 
         self._logging = LogForwarder(charm=self)
 
+        self.framework.observe(self.on.get_db_stats_action, self._on_get_db_stats_action)
+        self.framework.observe(self.on.collect_garbage_action, self._on_collect_garbage_action)
+        self.framework.observe(self.on.backup_db_action, self._on_backup_db_action)
+        self.framework.observe(self.on.optimize_db_action, self._on_optimize_db_action)
+
+    def _on_get_db_stats_action(self, event: ActionEvent):
+        """Reports size and row count statistics of the SQLite database."""
+        try:
+            stats = self.sqlite_store.component.get_stats()
+        except SqliteStoreError as err:
+            event.fail(str(err))
+            return
+        event.set_results(stats)
+
+    def _on_collect_garbage_action(self, event: ActionEvent):
+        """Deletes the metadata older than the retention window from the SQLite database."""
+        start = time.monotonic()
+        try:
+            deleted = self.sqlite_store.component.collect_garbage(
+                retention_days=event.params["retention-days"],
+                batch_size=event.params["batch-size"],
+                batch_interval=event.params["batch-interval"],
+            )
+        except SqliteStoreError as err:
+            event.fail(str(err))
+            return
+        event.set_results({"deleted": deleted, "duration": round(time.monotonic() - start, 3)})
+
+    def _on_backup_db_action(self, event: ActionEvent):
+        """Copies the SQLite database to a backup file while the server keeps running."""
+        destination = Path(event.params["path"])
+        # Relative paths would resolve against the charm directory, replaced on refresh
+        if not destination.is_absolute():
+            event.fail(f"path must be absolute, got '{destination}'")
+            return
+        try:
+            results = self.sqlite_store.component.backup(destination=destination)
+        except SqliteStoreError as err:
+            event.fail(str(err))
+            return
+        event.set_results(results)
+
+    def _on_optimize_db_action(self, event: ActionEvent):
+        """Refreshes the statistics and reclaims the free pages of the SQLite database."""
+        try:
+            results = self.sqlite_store.component.optimize(
+                max_pages=event.params["max-pages"],
+                max_duration=event.params["max-duration"],
+                batch_interval=event.params["batch-interval"],
+                full_vacuum=event.params["full-vacuum"],
+            )
+        except SqliteStoreError as err:
+            event.fail(str(err))
+            return
+        event.set_results(results)
+
+    @cached_property
+    def lightkube_client(self) -> lightkube.Client:
+        """Returns a lightkube Client shared by all Components, created on first use."""
+        return lightkube.Client()
+
 
 if __name__ == "__main__":
     main(Operator)
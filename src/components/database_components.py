@@ -0,0 +1,115 @@
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import logging
+from typing import Dict, List, Optional
+
+from charmed_kubeflow_chisme.components.component import Component
+from charmed_kubeflow_chisme.exceptions import ErrorWithStatus
+from charms.data_platform_libs.v0.data_interfaces import DatabaseRequires
+from ops import ActiveStatus, BlockedStatus, StatusBase, WaitingStatus
+
+logger = logging.getLogger(__name__)
+
+
+class DatabaseRequirerComponent(Component):
+    """Component that requests a database through the data_interfaces DatabaseRequires.
+
+    DatabaseRequires requests the database from the provider, including the credentials shared
+    as Juju secrets, and this Component exposes the connection details once they are available.
+
+    The relation is optional: when nothing is related, get_data() returns an empty dict and the
+    Component is Active so the charm falls back to its default (SQLite) backend.
+    """
+
+    def __init__(
+        self,
+        *args,
+        relation_name: str,
+        database_name: str,
+        conflicting_relations: Optional[List[str]] = None,
+        **kwargs,
+    ):
+        """Instantiate the DatabaseRequirerComponent.
+
+        Args:
+            relation_name: the name of the relation handled by this Component
+            database_name: the name of the database requested from the provider
+            conflicting_relations: names of relations that cannot be related at the same time as
+                                   this one, e.g. other database backends
+        """
+        super().__init__(*args, **kwargs)
+        self._relation_name = relation_name
+        self._database_name = database_name
+        self._conflicting_relations = conflicting_relations or []
+        self.database_requires = DatabaseRequires(
+            self._charm, relation_name=relation_name, database_name=database_name
+        )
+
+        self._events_to_observe = [
+            self.database_requires.on.database_created,
+            self.database_requires.on.endpoints_changed,
+            self._charm.on[self._relation_name].relation_broken,
+        ]
+
+    @property
+    def relation(self):
+        """Returns the relation handled by this Component, or None if it is not related."""
+        return self._charm.model.get_relation(self._relation_name)
+
+    @property
+    def is_related(self) -> bool:
+        """Returns True if a database application is related to this charm."""
+        relation = self.relation
+        return relation is not None and relation.app is not None
+
+    def get_data(self) -> Dict[str, str]:
+        """Returns the connection details shared by the database provider.
+
+        Raises:
+            ErrorWithStatus: if the relation exists but the provider has not shared credentials,
+                             or if a conflicting relation also exists.
+        """
+        if not self.is_related:
+            return {}
+
+        conflicts = [
+            name for name in self._conflicting_relations if self._charm.model.relations[name]
+        ]
+        if conflicts:
+            raise ErrorWithStatus(
+                f"Relation {self._relation_name} cannot be used together with"
+                f" {', '.join(conflicts)}",
+                BlockedStatus,
+            )
+
+        relation = self.relation
+        relation_data = self.database_requires.fetch_relation_data(
+            [relation.id], ["endpoints", "database", "username", "password"]
+        ).get(relation.id, {})
+        missing = [
+            key for key in ("endpoints", "username", "password") if not relation_data.get(key)
+        ]
+        if missing:
+            raise ErrorWithStatus(
+                f"Waiting for {', '.join(missing)} on relation {self._relation_name}",
+                WaitingStatus,
+            )
+
+        # Providers may share a comma-separated list of endpoints; MLMD only takes one
+        host, _, port = relation_data["endpoints"].split(",")[0].rpartition(":")
+        return {
+            "host": host,
+            "port": port,
+            "database": relation_data.get("database") or self._database_name,
+            "user": relation_data["username"],
+            "password": relation_data["password"],
+        }
+
+    def get_status(self) -> StatusBase:
+        """Returns the status of this Component based on the data shared by the provider."""
+        try:
+            self.get_data()
+        except ErrorWithStatus as err:
+            return err.status
+        return ActiveStatus()
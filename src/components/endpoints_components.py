@@ -0,0 +1,107 @@
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import logging
+from typing import Callable, List
+
+from charmed_kubeflow_chisme.components.component import Component
+from ops import ActiveStatus, StatusBase, Unit
+
+logger = logging.getLogger(__name__)
+
+ENDPOINTS_KEY = "endpoints"
+# Key of the peer unit data bags telling whether the workload of the unit is ready
+WORKLOAD_READY_KEY = "workload-ready"
+
+
+class UnitEndpointsProviderComponent(Component):
+    """Publishes the address of every unit whose workload is ready on a relation.
+
+    This is sent alongside the aggregated Service name and port, so clients doing their own
+    DNS-less load balancing can connect to each unit directly.  Every unit advertises whether
+    its workload is ready in the peer relation, and the leader only publishes the ready ones.
+    Units are addressed through the headless Service Juju creates for the application, with a
+    name relative to the cluster domain so it resolves whatever domain the cluster uses.
+    """
+
+    def __init__(
+        self,
+        *args,
+        relation_name: str,
+        peer_relation_name: str,
+        port: str,
+        enabled: Callable[[], bool],
+        run_on_all_units: Callable[[], bool],
+        workload_ready: Callable[[], bool],
+        **kwargs,
+    ):
+        """Instantiate the UnitEndpointsProviderComponent.
+
+        Args:
+            relation_name: the name of the relation to publish the endpoints on
+            peer_relation_name: the name of the peer relation used to discover the units
+            port: the port the workload listens on in every unit
+            enabled: a function returning whether the endpoints should be published.  When it
+                     returns False, any previously published endpoints are removed.
+            run_on_all_units: a function returning whether every unit serves the workload, or
+                              only the leader
+            workload_ready: a function returning whether the workload of this unit is ready
+        """
+        super().__init__(*args, **kwargs)
+        self._relation_name = relation_name
+        self._peer_relation_name = peer_relation_name
+        self._port = port
+        self._enabled = enabled
+        self._run_on_all_units = run_on_all_units
+        self._workload_ready = workload_ready
+
+        self._events_to_observe = [
+            self._charm.on[self._relation_name].relation_created,
+            self._charm.on[self._peer_relation_name].relation_joined,
+            self._charm.on[self._peer_relation_name].relation_changed,
+            self._charm.on[self._peer_relation_name].relation_departed,
+        ]
+
+    def _get_unit_address(self, unit: Unit) -> str:
+        """Returns the address of a unit through the headless Service of the application."""
+        pod_name = unit.name.replace("/", "-")
+        app_name = self._charm.app.name
+        namespace = self._charm.model.name
+        return f"{pod_name}.{app_name}-endpoints.{namespace}.svc:{self._port}"
+
+    def get_endpoints(self) -> List[str]:
+        """Returns the sorted addresses of the units whose workload is ready."""
+        units = {self._charm.unit} if self._workload_ready() else set()
+        if self._run_on_all_units():
+            peer_relation = self._charm.model.get_relation(self._peer_relation_name)
+            if peer_relation is not None:
+                units.update(
+                    unit
+                    for unit in peer_relation.units
+                    if peer_relation.data[unit].get(WORKLOAD_READY_KEY) == "true"
+                )
+        return sorted(self._get_unit_address(unit) for unit in units)
+
+    def _configure_unit(self, event):
+        """Advertises whether the workload of this unit is ready to the other units."""
+        peer_relation = self._charm.model.get_relation(self._peer_relation_name)
+        if peer_relation is None:
+            return
+        databag = peer_relation.data[self._charm.unit]
+        # Setting an empty value removes the key from the data bag
+        ready = "true" if self._workload_ready() else ""
+        if databag.get(WORKLOAD_READY_KEY, "") != ready:
+            databag[WORKLOAD_READY_KEY] = ready
+
+    def _configure_app_leader(self, event):
+        """Writes the unit endpoints to every relation, or removes them if disabled."""
+        endpoints = ",".join(self.get_endpoints()) if self._enabled() else ""
+        for relation in self._charm.model.relations[self._relation_name]:
+            databag = relation.data[self._charm.app]
+            # Setting an empty value removes the key from the data bag
+            if databag.get(ENDPOINTS_KEY, "") != endpoints:
+                databag[ENDPOINTS_KEY] = endpoints
+
+    def get_status(self) -> StatusBase:
+        """Returns the status of this Component."""
+        return ActiveStatus()
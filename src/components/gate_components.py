@@ -0,0 +1,44 @@
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import logging
+from typing import Callable
+
+from charmed_kubeflow_chisme.components import LeadershipGateComponent
+from ops import ActiveStatus, StatusBase
+
+logger = logging.getLogger(__name__)
+
+
+class WorkloadGateComponent(LeadershipGateComponent):
+    """Gates the workload on leadership, unless the workload can run on every unit.
+
+    With the SQLite backend each unit would get its own database on its own storage, so only the
+    leader runs the server.  With an external database backend every unit shares the same data,
+    so this gate opens on every unit and extra units add serving capacity.
+    """
+
+    def __init__(self, *args, run_on_all_units: Callable[[], bool], **kwargs):
+        """Instantiate the WorkloadGateComponent.
+
+        Args:
+            run_on_all_units: a function returning whether the workload can run on non-leader
+                              units, e.g. when an external database backend is related
+        """
+        super().__init__(*args, **kwargs)
+        self._run_on_all_units = run_on_all_units
+
+    @property
+    def run_on_all_units(self) -> bool:
+        """Returns True if the workload can run on every unit."""
+        return self._run_on_all_units()
+
+    def ready_for_execution(self) -> bool:
+        """Returns True if this is the leader or the workload can run on every unit."""
+        return self._charm.unit.is_leader() or self.run_on_all_units
+
+    def get_status(self) -> StatusBase:
+        """Returns the status of this Component."""
+        if self.run_on_all_units:
+            return ActiveStatus()
+        return super().get_status()
@@ -0,0 +1,179 @@
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import hashlib
+import json
+import logging
+from pathlib import Path
+from typing import Any, Callable, Optional, Set
+
+import lightkube
+from charmed_kubeflow_chisme.components.kubernetes_component import KubernetesComponent
+from charmed_kubeflow_chisme.exceptions import GenericCharmRuntimeError
+from charmed_kubeflow_chisme.kubernetes import KubernetesResourceHandler
+from charmed_kubeflow_chisme.lightkube.batch import delete_many
+from lightkube.core.exceptions import ApiError
+from ops import ActiveStatus, BlockedStatus, StatusBase
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_HASH_ANNOTATION = "charms.canonical.com/manifest-hash"
+
+
+def _is_subset(desired: Any, live: Any) -> bool:
+    """Returns True if every field set in desired has the same value in live.
+
+    Fields and list items only present in live, like the ones defaulted by the API server or owned
+    by another field manager, are ignored.
+    """
+    if isinstance(desired, dict):
+        return isinstance(live, dict) and all(
+            _is_subset(value, live.get(key)) for key, value in desired.items()
+        )
+    if isinstance(desired, list):
+        return isinstance(live, list) and all(
+            any(_is_subset(item, live_item) for live_item in live) for item in desired
+        )
+    return desired == live
+
+
+def _get_resource_key(resource: Any) -> tuple:
+    """Returns the key identifying a lightkube resource in the cluster."""
+    return type(resource), resource.metadata.namespace, resource.metadata.name
+
+
+class MlmdKubernetesComponent(KubernetesComponent):
+    """KubernetesComponent that talks to the API server lazily and only applies changes.
+
+    The lightkube Client is got from lightkube_client_getter only when a
+    KubernetesResourceHandler is built, so non-leader units, which never talk to the API
+    server, skip loading the kubeconfig and setting up the connection pool.  On the leader
+    every reconcile, including update-status, builds one.
+
+    Rendered manifests are annotated with a hash of their templates and context.  Resources are
+    only applied when a deployed resource is missing, carries a different hash, or drifted from
+    the rendered spec (e.g. after a `kubectl edit`).
+
+    The manifests can include the Service Juju creates for the application, named after it.  That
+    Service is applied like the others, but left for Juju to delete.
+    """
+
+    def __init__(self, *args, lightkube_client_getter: Callable[[], lightkube.Client], **kwargs):
+        super().__init__(*args, lightkube_client=None, **kwargs)
+        self._lightkube_client_getter = lightkube_client_getter
+        # Keys of the resources known to be deployed, listed at most once per hook
+        self._deployed_keys: Optional[Set[tuple]] = None
+
+    def _get_context(self) -> dict:
+        """Returns the context for the templates, including the hash of the manifests."""
+        context = self._context_callable()
+        digest = hashlib.sha256()
+        for template in self._resource_templates:
+            digest.update(Path(template).read_bytes())
+        digest.update(json.dumps(context, sort_keys=True, default=str).encode())
+        return {**context, "manifest_hash": digest.hexdigest()}
+
+    def _get_kubernetes_resource_handler(self) -> KubernetesResourceHandler:
+        """Returns a KubernetesResourceHandler for this class.
+
+        The lightkube Client is got from lightkube_client_getter.  Unlike KubernetesComponent,
+        this does not load the in-cluster generic resources, as only core resources are managed
+        and listing the CRDs would be a wasted API call.
+        """
+        return KubernetesResourceHandler(
+            field_manager="lightkube",
+            template_files=self._resource_templates,
+            context=self._get_context(),
+            lightkube_client=self._lightkube_client_getter(),
+            labels=self._krh_labels,
+            resource_types=self._krh_resource_types,
+        )
+
+    def _configure_app_leader(self, event):
+        """Applies the Kubernetes resources, unless the deployed ones are already up to date."""
+        try:
+            krh = self._get_kubernetes_resource_handler()
+            deployed = {
+                _get_resource_key(resource): resource for resource in krh.get_deployed_resources()
+            }
+            self._deployed_keys = set(deployed)
+            desired = krh.render_manifests()
+            if self._is_up_to_date(desired, deployed):
+                logger.info("Kubernetes resources are up to date - skipping apply.")
+                return
+            self._delete_services_with_changed_cluster_ip(krh, desired, deployed)
+            krh.apply()
+            self._deployed_keys = {_get_resource_key(resource) for resource in desired}
+        except ApiError as e:
+            raise GenericCharmRuntimeError("Failed to create Kubernetes resources") from e
+
+    @staticmethod
+    def _is_up_to_date(desired: list, deployed: dict) -> bool:
+        """Returns True if every desired resource is deployed with the same hash and spec."""
+        for resource in desired:
+            live = deployed.get(_get_resource_key(resource))
+            if live is None:
+                return False
+            live_hash = (live.metadata.annotations or {}).get(MANIFEST_HASH_ANNOTATION)
+            if live_hash != resource.metadata.annotations[MANIFEST_HASH_ANNOTATION]:
+                return False
+            if not _is_subset(resource.to_dict().get("spec"), live.to_dict().get("spec")):
+                logger.info(f"Drift detected on {resource.kind} {resource.metadata.name}.")
+                return False
+        return True
+
+    @staticmethod
+    def _delete_services_with_changed_cluster_ip(
+        krh: KubernetesResourceHandler, desired: list, deployed: dict
+    ):
+        """Deletes deployed Services switching to or from headless, so they can be re-created.
+
+        The clusterIP of a Service is immutable, so it cannot be changed by an apply.
+        """
+        to_delete = []
+        for resource in desired:
+            if resource.kind != "Service":
+                continue
+            live = deployed.get(_get_resource_key(resource))
+            if live is None:
+                continue
+            desired_headless = resource.spec.clusterIP == "None"
+            live_headless = live.spec.clusterIP == "None"
+            if desired_headless != live_headless:
+                logger.info(f"Re-creating Service {live.metadata.name} to change its clusterIP.")
+                to_delete.append(live)
+        delete_many(krh.lightkube_client, to_delete, ignore_missing=True)
+
+    def remove(self, event):
+        """Removes all deployed resources, except the Service Juju created for the application."""
+        krh = self._get_kubernetes_resource_handler()
+        resources_to_delete = [
+            resource
+            for resource in krh.get_deployed_resources()
+            if not (resource.kind == "Service" and resource.metadata.name == self._charm.app.name)
+        ]
+        delete_many(krh.lightkube_client, resources_to_delete, ignore_missing=True)
+
+    def get_status(self) -> StatusBase:
+        """Returns Blocked if a desired resource is not deployed, Active otherwise.
+
+        The resources listed by _configure_app_leader in the same hook are reused, so computing
+        the status does not list them again.
+        """
+        if not self._charm.unit.is_leader():
+            return ActiveStatus()
+
+        krh = self._get_kubernetes_resource_handler()
+        if self._deployed_keys is None:
+            self._deployed_keys = {
+                _get_resource_key(resource) for resource in krh.get_deployed_resources()
+            }
+        if any(
+            _get_resource_key(resource) not in self._deployed_keys
+            for resource in krh.render_manifests()
+        ):
+            return BlockedStatus(
+                "Not all resources found in cluster.  This may be transient if we haven't tried "
+                "to deploy them yet."
+            )
+        return ActiveStatus()
@@ -1,43 +1,246 @@
 # Copyright 2023 Canonical Ltd.
 # See LICENSE file for licensing details.
 
+import hashlib
+import json
 import logging
+import re
+from typing import Callable, Dict, Optional
 
 from charmed_kubeflow_chisme.components.pebble_component import PebbleServiceComponent
-from ops.pebble import Layer
+from charmed_kubeflow_chisme.exceptions import ErrorWithStatus
+from ops import ActiveStatus, BlockedStatus, StatusBase, WaitingStatus
+from ops.pebble import CheckLevel, CheckStatus, Layer
 
 logger = logging.getLogger(__name__)
 
+# Environment variables of the service, holding the digests of the pushed files and the layer
+CONFIG_DIGEST_ENV = "MLMD_CONFIG_DIGEST"
+LAYER_DIGEST_ENV = "MLMD_LAYER_DIGEST"
+
+DEFAULT_GRPC_CHANNEL_ARGS = {
+    "grpc.max_metadata_size": 16384,
+    "grpc.max_receive_message_length": 104857600,
+    "grpc.max_send_message_length": 104857600,
+}
+# Integer channel arguments that can be tuned through the grpc-channel-args config option
+ALLOWED_GRPC_CHANNEL_ARGS = {
+    *DEFAULT_GRPC_CHANNEL_ARGS,
+    "grpc.max_concurrent_streams",
+    "grpc.http2.lookahead_bytes",
+    "grpc.http2.bdp_probe",
+    "grpc.http2.max_frame_size",
+    "grpc.http2.write_buffer_size",
+    "grpc.http2.max_pings_without_data",
+    "grpc.http2.min_ping_interval_without_data_ms",
+    "grpc.keepalive_time_ms",
+    "grpc.keepalive_timeout_ms",
+    "grpc.keepalive_permit_without_calls",
+    "grpc.max_connection_idle_ms",
+    "grpc.max_connection_age_ms",
+    "grpc.max_connection_age_grace_ms",
+    "grpc.server.max_unrequested_time_in_server",
+}
+# Durations as accepted by Pebble, e.g. "500ms", "1m30s"
+DURATION_REGEX = r"^(\d+(\.\d+)?(ns|us|ms|s|m|h))+$"
+
+
+def parse_grpc_channel_args(grpc_channel_args: str) -> Dict[str, int]:
+    """Parses a comma-separated list of key=value gRPC channel arguments.
+
+    Raises:
+        ErrorWithStatus: if an argument is malformed, unknown or does not have an integer value.
+    """
+    parsed = {}
+    for argument in filter(None, (arg.strip() for arg in grpc_channel_args.split(","))):
+        key, separator, value = (part.strip() for part in argument.partition("="))
+        if not separator or key not in ALLOWED_GRPC_CHANNEL_ARGS:
+            raise ErrorWithStatus(f"Invalid gRPC channel argument '{argument}'", BlockedStatus)
+        try:
+            parsed[key] = int(value)
+        except ValueError:
+            raise ErrorWithStatus(
+                f"gRPC channel argument {key} must be an integer, got '{value}'", BlockedStatus
+            )
+    return parsed
+
+
+def validate_duration(name: str, duration: str):
+    """Raises an ErrorWithStatus if duration is not a valid Pebble duration."""
+    if not re.match(DURATION_REGEX, duration):
+        raise ErrorWithStatus(
+            f"Invalid {name} '{duration}', expected a duration like 500ms or 1m30s", BlockedStatus
+        )
+
 
 class MlmdPebbleService(PebbleServiceComponent):
-    def __init__(self, *args, grpc_port: str, metadata_store_server_config_file: str, **kwargs):
-        """Pebble service component that configures the Pebble layer."""
+    def __init__(
+        self,
+        *args,
+        grpc_port: str,
+        metadata_store_server_config_file: str,
+        grpc_channel_args: str = "",
+        backoff_delay: str = "500ms",
+        backoff_factor: float = 2.0,
+        backoff_limit: str = "30s",
+        enable_database_upgrade: Optional[Callable[[], bool]] = None,
+        **kwargs,
+    ):
+        """Pebble service component that configures the Pebble layer.
+
+        Args:
+            grpc_port: the port the metadata_store_server listens on
+            metadata_store_server_config_file: path to the server config file in the container
+            grpc_channel_args: comma-separated key=value gRPC channel arguments
+            backoff_delay: initial delay before Pebble restarts the service after a failure
+            backoff_factor: factor by which the delay grows after each consecutive restart
+            backoff_limit: maximum delay between restarts
+            enable_database_upgrade: (optional) a function returning whether this unit's server
+                                     migrates the database schema on start.  Only one unit
+                                     should when several share an external database.
+        """
         super().__init__(*args, **kwargs)
         self._grpc_port = grpc_port
         self._metadata_store_server_config_file = metadata_store_server_config_file
+        self._grpc_channel_args = grpc_channel_args
+        self._backoff_delay = backoff_delay
+        self._backoff_factor = backoff_factor
+        self._backoff_limit = backoff_limit
+        self._enable_database_upgrade = enable_database_upgrade or (lambda: True)
+
+    @property
+    def alive_check_name(self) -> str:
+        """Returns the name of the Pebble check that restarts the service when failing."""
+        return f"{self.service_name}-alive"
+
+    @property
+    def ready_check_name(self) -> str:
+        """Returns the name of the Pebble check that gates the unit readiness."""
+        return f"{self.service_name}-ready"
+
+    def get_files_digest(self) -> str:
+        """Returns a digest of the rendered files pushed to the container."""
+        digest = hashlib.sha256()
+        for container_file_template in self._files_to_push:
+            digest.update(str(container_file_template.destination_path).encode())
+            digest.update(container_file_template.render_source_template().encode())
+        return digest.hexdigest()
+
+    def _validate(self):
+        """Raises an ErrorWithStatus if any of the configured inputs is invalid."""
+        parse_grpc_channel_args(self._grpc_channel_args)
+        validate_duration("restart-backoff-delay", self._backoff_delay)
+        validate_duration("restart-backoff-limit", self._backoff_limit)
+        if self._backoff_factor < 1:
+            raise ErrorWithStatus(
+                f"Invalid restart-backoff-factor {self._backoff_factor}, must be at least 1",
+                BlockedStatus,
+            )
+
+    @property
+    def grpc_channel_args(self) -> Dict[str, int]:
+        """Returns the default gRPC channel arguments merged with the configured ones."""
+        return {**DEFAULT_GRPC_CHANNEL_ARGS, **parse_grpc_channel_args(self._grpc_channel_args)}
 
     def get_layer(self) -> Layer:
         """Pebble configuration layer for MLMD GRPC Server"""
+        self._validate()
+        grpc_channel_arguments = ",".join(
+            f"{key}={value}" for key, value in self.grpc_channel_args.items()
+        )
         command = (
             "bin/metadata_store_server"
             f" --metadata_store_server_config_file={self._metadata_store_server_config_file}"
             f" --grpc_port={self._grpc_port}"
-            " --enable_database_upgrade=true"
-            " --grpc_channel_arguments=grpc.max_metadata_size=16384,"
-            "grpc.max_receive_message_length=104857600,"
-            "grpc.max_send_message_length=104857600"
+            f" --enable_database_upgrade={str(self._enable_database_upgrade()).lower()}"
+            f" --grpc_channel_arguments={grpc_channel_arguments}"
         )
-        layer = Layer(
-            {
-                "services": {
-                    self.service_name: {
-                        "override": "replace",
-                        "summary": "entry point for MLMD GRPC Service",
-                        "command": command,  # Must be a string
-                        "startup": "enabled",
-                    }
+        layer = {
+            "services": {
+                self.service_name: {
+                    "override": "replace",
+                    "summary": "entry point for MLMD GRPC Service",
+                    "command": command,  # Must be a string
+                    "startup": "enabled",
+                    # Changes to the pushed files change the service definition, so the
+                    # replan restarts the server only when its configuration changed
+                    "environment": {CONFIG_DIGEST_ENV: self.get_files_digest()},
+                    "on-check-failure": {self.alive_check_name: "restart"},
+                    "backoff-delay": self._backoff_delay,
+                    "backoff-factor": self._backoff_factor,
+                    "backoff-limit": self._backoff_limit,
+                }
+            },
+            # The workload image ships no gRPC client, so the checks probe the gRPC port.
+            # Juju gates the pod readiness on the ready checks, so Kubernetes stops routing
+            # traffic to this unit while they fail.
+            "checks": {
+                self.ready_check_name: {
+                    "override": "replace",
+                    "level": "ready",
+                    "tcp": {"port": int(self._grpc_port)},
+                    "period": "5s",
+                    "timeout": "3s",
+                    "threshold": 1,
                 },
-            }
-        )
+                self.alive_check_name: {
+                    "override": "replace",
+                    "level": "alive",
+                    "tcp": {"port": int(self._grpc_port)},
+                    "period": "10s",
+                    "timeout": "3s",
+                    "threshold": 3,
+                },
+            },
+        }
+
+        # Pebble normalizes some values of the plan it returns (e.g. durations and floats), so
+        # the layer carries its own digest for _configure_unit to compare against
+        digest = hashlib.sha256(json.dumps(layer, sort_keys=True).encode()).hexdigest()
+        layer["services"][self.service_name]["environment"][LAYER_DIGEST_ENV] = digest
+        return Layer(layer)
+
+    def _configure_unit(self, event):
+        """Pushes the files and updates the Pebble layer, skipping both if nothing changed.
+
+        The layer embeds the digest of the rendered files and its own digest, so comparing the
+        digest stored in the service of the current plan with the one of the new layer tells
+        whether the pushed files or the layer changed without reading the files back from the
+        container.  The plan is lost when the container restarts, so the files are pushed again
+        whenever the workload comes back.
+        """
+        if not self.pebble_ready:
+            logger.info(f"Container {self.container_name} not ready - cannot configure unit.")
+            return
+
+        container = self._charm.unit.get_container(self.container_name)
+        new_layer = self.get_layer()
+
+        new_digest = new_layer.services[self.service_name].environment[LAYER_DIGEST_ENV]
+        current_service = container.get_plan().services.get(self.service_name)
+        if current_service and current_service.environment.get(LAYER_DIGEST_ENV) == new_digest:
+            logger.debug("Pebble layer for %s unchanged - skipping push and replan.", self.name)
+            return
+
+        self._push_files_to_container()
+        container.add_layer(self.container_name, new_layer, combine=True)
+        container.replan()
+
+    def get_status(self) -> StatusBase:
+        """Returns the status of this Component, including the state of its ready check."""
+        try:
+            self._validate()
+        except ErrorWithStatus as err:
+            return err.status
+
+        status = super().get_status()
+        if not isinstance(status, ActiveStatus):
+            return status
 
-        return layer
+        container = self._charm.unit.get_container(self.container_name)
+        ready_checks = container.get_checks(self.ready_check_name, level=CheckLevel.READY)
+        if any(check.status == CheckStatus.DOWN for check in ready_checks.values()):
+            return WaitingStatus(
+                f"Pebble check {self.ready_check_name} is failing, the unit is not ready"
+            )
+        return status
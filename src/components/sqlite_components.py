@@ -0,0 +1,671 @@
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import logging
+import math
+import os
+import re
+import sqlite3
+import time
+from contextlib import closing
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from charmed_kubeflow_chisme.components.component import Component
+from charmed_kubeflow_chisme.exceptions import ErrorWithStatus
+from ops import ActiveStatus, BlockedStatus, StatusBase, StoredState, pebble
+
+logger = logging.getLogger(__name__)
+
+# Journal modes that keep the database durable; MEMORY and OFF are deliberately left out
+SQLITE_JOURNAL_MODES = ["delete", "truncate", "persist", "wal"]
+# Suffixes of the files SQLite keeps next to the database, created with the mode of the database
+SQLITE_FILE_SUFFIXES = ["", "-wal", "-shm", "-journal"]
+
+# Tables of the MLMD schema that grow with the pipeline runs recorded in the store
+MLMD_TABLES = [
+    "Artifact",
+    "ArtifactProperty",
+    "Execution",
+    "ExecutionProperty",
+    "Context",
+    "ContextProperty",
+    "ParentContext",
+    "Event",
+    "EventPath",
+    "Attribution",
+    "Association",
+]
+
+# Queries selecting a batch of rows older than a cutoff that garbage collection can delete.
+# Artifacts and contexts are only deleted once no execution left references them, and contexts
+# are kept while they are the parent of another context.
+GC_CANDIDATE_QUERIES = {
+    "Execution": "SELECT id FROM Execution WHERE last_update_time_since_epoch < ? LIMIT ?",
+    "Artifact": (
+        "SELECT id FROM Artifact WHERE last_update_time_since_epoch < ?"
+        " AND NOT EXISTS (SELECT 1 FROM Event WHERE Event.artifact_id = Artifact.id) LIMIT ?"
+    ),
+    "Context": (
+        "SELECT id FROM Context WHERE last_update_time_since_epoch < ?"
+        " AND NOT EXISTS (SELECT 1 FROM Association WHERE Association.context_id = Context.id)"
+        " AND NOT EXISTS (SELECT 1 FROM Attribution WHERE Attribution.context_id = Context.id)"
+        " AND NOT EXISTS"
+        " (SELECT 1 FROM ParentContext WHERE ParentContext.parent_context_id = Context.id)"
+        " LIMIT ?"
+    ),
+}
+
+# Statements deleting the rows that reference a batch of deleted rows, run before the rows
+# themselves are deleted
+GC_CASCADE_STATEMENTS = {
+    "Execution": [
+        "DELETE FROM EventPath WHERE event_id IN"
+        " (SELECT id FROM Event WHERE execution_id IN ({ids}))",
+        "DELETE FROM Event WHERE execution_id IN ({ids})",
+        "DELETE FROM ExecutionProperty WHERE execution_id IN ({ids})",
+        "DELETE FROM Association WHERE execution_id IN ({ids})",
+    ],
+    "Artifact": [
+        "DELETE FROM ArtifactProperty WHERE artifact_id IN ({ids})",
+        "DELETE FROM Attribution WHERE artifact_id IN ({ids})",
+    ],
+    "Context": [
+        "DELETE FROM ContextProperty WHERE context_id IN ({ids})",
+        "DELETE FROM ParentContext WHERE context_id IN ({ids})",
+    ],
+}
+
+# PRAGMA auto_vacuum value of databases whose free pages can be reclaimed incrementally
+SQLITE_AUTO_VACUUM_INCREMENTAL = 2
+# Rows sampled per index by ANALYZE, so it takes about the same time whatever the table size
+SQLITE_ANALYSIS_LIMIT = 1000
+# Queries timed before and after maintenance, similar to the list queries of MLMD clients
+MAINTENANCE_PROBE_QUERIES = {
+    table: f"SELECT id FROM {table} ORDER BY last_update_time_since_epoch DESC LIMIT 100"
+    for table in ["Execution", "Artifact", "Context"]
+}
+# Parameters of the steps run in the maintenance window.  They run within a reconcile, during
+# which the unit handles no other event, so each is capped to a few seconds; a backlog is worked
+# through on the following days, or at once with the actions.
+MAINTENANCE_GC_DEFAULTS = {"batch_size": 200, "batch_interval": 0.1, "max_duration": 10.0}
+MAINTENANCE_DEFAULTS = {"max_pages": 1000, "max_duration": 10.0, "batch_interval": 0.1}
+# Minimum time between two maintenance runs in the maintenance window, in seconds
+MAINTENANCE_INTERVAL = 20 * 3600
+MAINTENANCE_WINDOW_REGEX = r"^([01]\d|2[0-3]):([0-5]\d)-([01]\d|2[0-3]):([0-5]\d)$"
+
+
+class SqliteStoreError(Exception):
+    """Raised when an operation on the SQLite database cannot be performed."""
+
+
+def _fetch_ids(connection: sqlite3.Connection, query: str, *parameters) -> List[int]:
+    """Returns the ids selected by a query."""
+    return [row[0] for row in connection.execute(query, parameters)]
+
+
+def _parse_maintenance_window(window: str) -> Tuple[int, int]:
+    """Returns the start and end of a HH:MM-HH:MM window, in minutes since midnight."""
+    start_hour, start_minute, end_hour, end_minute = re.match(
+        MAINTENANCE_WINDOW_REGEX, window
+    ).groups()
+    return int(start_hour) * 60 + int(start_minute), int(end_hour) * 60 + int(end_minute)
+
+
+def _measure(database_path: Path) -> Tuple[int, int, float]:
+    """Returns the page count, freelist count and duration of the probe queries in ms.
+
+    Each measurement opens its own connection, so the probe queries never start with pages
+    cached by a previous measurement or by the maintenance.
+    """
+    with closing(
+        sqlite3.connect(f"file:{database_path}?mode=ro", uri=True, timeout=5)
+    ) as connection:
+        (page_count,) = connection.execute("PRAGMA page_count").fetchone()
+        (freelist_count,) = connection.execute("PRAGMA freelist_count").fetchone()
+        existing_tables = {
+            name
+            for (name,) in connection.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'"
+            )
+        }
+        start = time.perf_counter()
+        for table, query in MAINTENANCE_PROBE_QUERIES.items():
+            if table in existing_tables:
+                connection.execute(query).fetchall()
+    return page_count, freelist_count, (time.perf_counter() - start) * 1000
+
+
+def _to_result_key(name: str) -> str:
+    """Converts a CamelCase table name to a key allowed in action results, e.g. event-path."""
+    return re.sub(r"(?<!^)(?=[A-Z])", "-", name).lower()
+
+
+class SqliteStoreComponent(Component):
+    """Component that tunes the SQLite database shared with the workload through storage.
+
+    The storage mounted in the workload container is also mounted in the charm container, so the
+    charm can open the database file directly.  Only settings persisted in the database file
+    itself (like the journal mode) have an effect on the metadata_store_server connections.
+
+    The workload user creates the database with mode 0644, so the charm user could only read it.
+    Before writing, the files are handed to the group of the charm user and made group-writable
+    by the workload user in its container.  SQLite creates the -wal, -shm and -journal files with
+    the mode of the database, so both users can then write all of them.
+    """
+
+    _stored = StoredState()
+
+    def __init__(
+        self,
+        *args,
+        storage_name: str,
+        database_file: str,
+        container_name: str,
+        workload_user: str,
+        journal_mode: str,
+        maintenance_window: str = "",
+        retention_days: int = 0,
+        enabled: Optional[Callable[[], bool]] = None,
+        **kwargs,
+    ):
+        """Instantiate the SqliteStoreComponent.
+
+        Args:
+            storage_name: the name of the storage holding the database, as in metadata.yaml
+            database_file: the name of the database file relative to the storage location
+            container_name: the name of the workload container, where the storage is mounted too
+            workload_user: the user the workload creates the database as
+            journal_mode: the SQLite journal mode to set on the database
+            maintenance_window: (optional) daily HH:MM-HH:MM UTC window in which the leader
+                                collects garbage and optimizes the database
+            retention_days: (optional) number of days of history kept by the garbage collection
+                            run in the maintenance window, 0 to not collect garbage
+            enabled: (optional) a function returning whether SQLite is the active backend.  When
+                     it returns False, this Component does nothing.
+        """
+        super().__init__(*args, **kwargs)
+        self._storage_name = storage_name
+        self._database_file = database_file
+        self._container_name = container_name
+        self._workload_user = workload_user
+        self._journal_mode = journal_mode.lower()
+        self._maintenance_window = maintenance_window
+        self._retention_days = retention_days
+        self._enabled = enabled or (lambda: True)
+        # Why the database could not be configured in this hook, reported by get_status()
+        self._configuration_error: Optional[str] = None
+        self._stored.set_default(
+            last_size_sample={}, last_maintenance_time=0.0, last_maintenance_error=""
+        )
+
+    @property
+    def database_path(self) -> Optional[Path]:
+        """Returns the path to the database in the charm container, or None if not attached."""
+        storages = self._charm.model.storages[self._storage_name]
+        if not storages:
+            return None
+        return Path(storages[0].location) / self._database_file
+
+    def _get_existing_database_path(self) -> Path:
+        """Returns the path to the database, raising a SqliteStoreError if it is not usable.
+
+        The database is made writable by the charm first.  Even read-only connections need to
+        write the -shm file of a database in WAL mode.
+        """
+        if not self._enabled():
+            raise SqliteStoreError("SQLite is not in use, an external database is related")
+        database_path = self.database_path
+        if database_path is None or not database_path.exists():
+            raise SqliteStoreError("SQLite database not created yet")
+        self._share_database(database_path)
+        return database_path
+
+    @staticmethod
+    def _get_database_files(database_path: Path) -> List[Path]:
+        """Returns the existing files of the database, including its WAL, shm and journal."""
+        paths = [
+            database_path.with_name(database_path.name + suffix) for suffix in SQLITE_FILE_SUFFIXES
+        ]
+        return [path for path in paths if path.exists()]
+
+    @classmethod
+    def _get_access_error(cls, database_path: Path) -> Optional[str]:
+        """Returns why the charm cannot write the database, or None if it can."""
+        # The same effective ids as the ones SQLite gets checked against when opening the files
+        if not os.access(database_path.parent, os.W_OK | os.X_OK, effective_ids=True):
+            return f"{database_path.parent} is not writable by the charm"
+        for path in cls._get_database_files(database_path):
+            if not os.access(path, os.R_OK | os.W_OK, effective_ids=True):
+                return f"{path.name} is not writable by the charm"
+        return None
+
+    def _share_database(self, database_path: Path):
+        """Makes the database writable by the charm, from the workload container if needed.
+
+        chgrp only succeeds if the workload user is a member of the group of the charm user,
+        which it must be to write the files the charm creates in turn.
+
+        Raises:
+            SqliteStoreError: if the charm still cannot write the database
+        """
+        if self._get_access_error(database_path) is None:
+            return
+        paths = [str(path) for path in self._get_database_files(database_path)]
+        container = self._charm.unit.get_container(self._container_name)
+        try:
+            for command in (["chgrp", str(os.getegid()), *paths], ["chmod", "g+rw", *paths]):
+                container.exec(command, user=self._workload_user).wait()
+        except pebble.Error as err:
+            raise SqliteStoreError(
+                f"Failed to make {database_path.name} writable by the charm: {err}"
+            ) from err
+
+        error = self._get_access_error(database_path)
+        if error:
+            raise SqliteStoreError(error)
+        logger.info(f"SQLite database {database_path} made writable by the charm.")
+
+    def get_checkpoint_command(self) -> Optional[List[str]]:
+        """Returns a command copying the WAL into the database file, or None if SQLite is not used.
+
+        The command runs in the charm container, where the storage is mounted too, as the
+        workload image has no SQLite runtime.  It relies on the database having been made
+        writable by the charm when the leader configured it.  It leaves the database file
+        self-contained with an empty WAL, and does nothing in journal modes other than WAL.  It
+        fails rather than create the database if it does not exist yet, and when readers kept
+        the checkpoint from completing.
+        """
+        database_path = self.database_path
+        if not self._enabled() or database_path is None:
+            return None
+        script = (
+            "import sqlite3, sys; "
+            f"connection = sqlite3.connect('file:{database_path}?mode=rw', uri=True, timeout=20); "
+            "busy, _, _ = connection.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone(); "
+            "sys.exit(busy)"
+        )
+        return ["python3", "-c", script]
+
+    def get_stats(self) -> Dict:
+        """Returns size and row count statistics of the database.
+
+        The database is opened read-only, so this never takes a write lock.  The growth rate is
+        computed against the sample taken the previous time this was called, if any.
+
+        Raises:
+            SqliteStoreError: if SQLite is not the active backend or the database cannot be read
+        """
+        database_path = self._get_existing_database_path()
+        wal_path = database_path.with_name(f"{database_path.name}-wal")
+        try:
+            with closing(
+                sqlite3.connect(f"file:{database_path}?mode=ro", uri=True, timeout=5)
+            ) as connection:
+                (page_size,) = connection.execute("PRAGMA page_size").fetchone()
+                (page_count,) = connection.execute("PRAGMA page_count").fetchone()
+                (freelist_count,) = connection.execute("PRAGMA freelist_count").fetchone()
+                existing_tables = {
+                    name
+                    for (name,) in connection.execute(
+                        "SELECT name FROM sqlite_master WHERE type = 'table'"
+                    )
+                }
+                rows = {
+                    _to_result_key(table): connection.execute(
+                        f'SELECT COUNT(*) FROM "{table}"'
+                    ).fetchone()[0]
+                    for table in MLMD_TABLES
+                    if table in existing_tables
+                }
+        except sqlite3.Error as err:
+            raise SqliteStoreError(f"Failed to read {database_path}: {err}") from err
+
+        stats = {
+            "file-size": database_path.stat().st_size,
+            "wal-size": wal_path.stat().st_size if wal_path.exists() else 0,
+            "page-size": page_size,
+            "page-count": page_count,
+            "freelist-count": freelist_count,
+            "rows": rows,
+        }
+
+        now = time.time()
+        total_size = stats["file-size"] + stats["wal-size"]
+        last_sample = self._stored.last_size_sample
+        if last_sample and now > last_sample["time"]:
+            stats["growth-bytes-per-hour"] = round(
+                (total_size - last_sample["size"]) / (now - last_sample["time"]) * 3600
+            )
+        self._stored.last_size_sample = {"time": now, "size": total_size}
+        return stats
+
+    def collect_garbage(
+        self,
+        retention_days: int,
+        batch_size: int,
+        batch_interval: float,
+        max_duration: Optional[float] = None,
+    ) -> Dict[str, int]:
+        """Deletes executions, artifacts and contexts not updated within the retention window.
+
+        Rows are deleted in batches of at most batch_size, each in its own short transaction,
+        pausing batch_interval seconds in between so the metadata_store_server is never kept
+        from writing for long.  Rows left when max_duration has passed are collected by the next
+        run.
+
+        Args:
+            retention_days: number of days of history to keep
+            batch_size: maximum number of rows deleted from a table in one transaction
+            batch_interval: seconds to wait between transactions
+            max_duration: (optional) seconds after which no more batches are deleted
+
+        Returns:
+            The number of executions, artifacts and contexts deleted
+
+        Raises:
+            SqliteStoreError: if SQLite is not the active backend or the database cannot be written
+        """
+        database_path = self._get_existing_database_path()
+        cutoff = int((time.time() - retention_days * 24 * 3600) * 1000)
+        deadline = time.monotonic() + max_duration if max_duration is not None else math.inf
+        deleted = {}
+        try:
+            # Transactions are managed explicitly so they can take the write lock upfront
+            with closing(
+                sqlite3.connect(database_path, timeout=5, isolation_level=None)
+            ) as connection:
+                for table in GC_CANDIDATE_QUERIES:
+                    deleted[_to_result_key(table) + "s"] = self._delete_in_batches(
+                        connection, table, cutoff, batch_size, batch_interval, deadline
+                    )
+        except sqlite3.Error as err:
+            raise SqliteStoreError(f"Failed to collect garbage in {database_path}: {err}") from err
+
+        logger.info(f"Garbage collection deleted {deleted} older than {retention_days} days.")
+        return deleted
+
+    @staticmethod
+    def _delete_in_batches(
+        connection: sqlite3.Connection,
+        table: str,
+        cutoff: int,
+        batch_size: int,
+        batch_interval: float,
+        deadline: float,
+    ) -> int:
+        """Deletes the garbage collection candidates of a table, returning the number deleted.
+
+        Batches are deleted until no candidate is left or the deadline has passed, so contexts
+        whose children were all deleted in a previous batch are collected in the same run.
+        """
+        deleted = 0
+        while time.monotonic() < deadline:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                ids = _fetch_ids(connection, GC_CANDIDATE_QUERIES[table], cutoff, batch_size)
+                if ids:
+                    placeholders = ", ".join("?" * len(ids))
+                    for statement in GC_CASCADE_STATEMENTS[table]:
+                        connection.execute(statement.format(ids=placeholders), ids)
+                    connection.execute(f"DELETE FROM {table} WHERE id IN ({placeholders})", ids)
+                connection.execute("COMMIT")
+            except sqlite3.Error:
+                connection.execute("ROLLBACK")
+                raise
+
+            if not ids:
+                break
+            deleted += len(ids)
+            time.sleep(batch_interval)
+        return deleted
+
+    def backup(self, destination: Path) -> Dict:
+        """Copies the database to destination with the SQLite online backup API.
+
+        The database is copied in a single step, within one read transaction.  Copying in
+        several steps would release the read lock in between, and any write from another
+        connection then makes SQLite restart the copy, so under a steady write load it may never
+        complete.  In WAL mode the metadata_store_server keeps writing during the copy; in the
+        other journal modes its writes wait until the copy completes.  The copy is written to a
+        temporary file first and only moved to destination once complete.
+
+        Args:
+            destination: path of the backup file
+
+        Returns:
+            The path of the backup, the bytes copied, and the duration and throughput
+
+        Raises:
+            SqliteStoreError: if SQLite is not the active backend or the backup fails
+        """
+        database_path = self._get_existing_database_path()
+        partial_destination = destination.with_name(f"{destination.name}.partial")
+
+        start = time.monotonic()
+        try:
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            with closing(
+                sqlite3.connect(f"file:{database_path}?mode=ro", uri=True, timeout=5)
+            ) as source, closing(sqlite3.connect(partial_destination)) as target:
+                source.backup(target, pages=-1)
+            partial_destination.replace(destination)
+        except (sqlite3.Error, OSError) as err:
+            partial_destination.unlink(missing_ok=True)
+            raise SqliteStoreError(f"Failed to back up {database_path}: {err}") from err
+        duration = time.monotonic() - start
+
+        size = destination.stat().st_size
+        logger.info(f"Backed up {database_path} to {destination} ({size} bytes).")
+        return {
+            "path": str(destination),
+            "bytes": size,
+            "duration": round(duration, 3),
+            "throughput-bytes-per-second": round(size / duration) if duration else size,
+        }
+
+    def optimize(
+        self, max_pages: int, max_duration: float, batch_interval: float, full_vacuum: bool = False
+    ) -> Dict:
+        """Refreshes the query planner statistics and reclaims free pages of the database.
+
+        ANALYZE samples a bounded number of rows per index, so it takes a short write lock
+        whatever the size of the database.  Free pages are then reclaimed with incremental
+        vacuum, max_pages per transaction and for at most max_duration seconds.  Incremental
+        vacuum requires the database to be in auto_vacuum=INCREMENTAL mode, which only a full
+        VACUUM can switch an existing database to.
+
+        Args:
+            max_pages: maximum number of free pages reclaimed in one transaction
+            max_duration: seconds after which no more free pages are reclaimed
+            batch_interval: seconds to wait between transactions
+            full_vacuum: whether to first switch the database to auto_vacuum=INCREMENTAL with a
+                         full VACUUM, which rewrites the whole database and blocks writes until
+                         it completes
+
+        Returns:
+            The pages reclaimed, the size of the database and the duration of the probe queries
+            before and after maintenance
+
+        Raises:
+            SqliteStoreError: if SQLite is not the active backend or the maintenance fails
+        """
+        database_path = self._get_existing_database_path()
+        start = time.monotonic()
+        reclaimed = 0
+        try:
+            _, _, latency_before = _measure(database_path)
+            # Transactions are managed explicitly so they can take the write lock upfront
+            with closing(
+                sqlite3.connect(database_path, timeout=5, isolation_level=None)
+            ) as connection:
+                if full_vacuum:
+                    (reclaimed,) = connection.execute("PRAGMA freelist_count").fetchone()
+                    connection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                    connection.execute("VACUUM")
+                connection.execute(f"PRAGMA analysis_limit={SQLITE_ANALYSIS_LIMIT}")
+                connection.execute("ANALYZE")
+                connection.execute("PRAGMA optimize")
+                (auto_vacuum,) = connection.execute("PRAGMA auto_vacuum").fetchone()
+                incremental = auto_vacuum == SQLITE_AUTO_VACUUM_INCREMENTAL
+                if incremental:
+                    reclaimed += self._incremental_vacuum(
+                        connection, max_pages, start + max_duration, batch_interval
+                    )
+            pages_after, freelist_after, latency_after = _measure(database_path)
+        except sqlite3.Error as err:
+            raise SqliteStoreError(f"Failed to optimize {database_path}: {err}") from err
+
+        self._stored.last_maintenance_error = ""
+        results = {
+            "pages-reclaimed": reclaimed,
+            "page-count": pages_after,
+            "freelist-count": freelist_after,
+            "incremental-vacuum": "enabled" if incremental else "disabled",
+            "probe-latency-ms-before": round(latency_before, 3),
+            "probe-latency-ms-after": round(latency_after, 3),
+            "duration": round(time.monotonic() - start, 3),
+        }
+        logger.info(f"SQLite maintenance of {database_path} done: {results}")
+        return results
+
+    @staticmethod
+    def _incremental_vacuum(
+        connection: sqlite3.Connection, max_pages: int, deadline: float, batch_interval: float
+    ) -> int:
+        """Reclaims free pages in transactions of max_pages until none is left or the deadline.
+
+        Returns:
+            The number of pages reclaimed, counted from the freelist within each transaction so
+            pages allocated or freed by the server in between are not counted
+        """
+        reclaimed = 0
+        while time.monotonic() < deadline:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                (freelist_before,) = connection.execute("PRAGMA freelist_count").fetchone()
+                # The pragma frees one page per returned row, so the rows must all be fetched
+                connection.execute(f"PRAGMA incremental_vacuum({max_pages})").fetchall()
+                (freelist_after,) = connection.execute("PRAGMA freelist_count").fetchone()
+                connection.execute("COMMIT")
+            except sqlite3.Error:
+                connection.execute("ROLLBACK")
+                raise
+
+            reclaimed += freelist_before - freelist_after
+            if not freelist_after:
+                break
+            time.sleep(batch_interval)
+        return reclaimed
+
+    def _is_maintenance_due(self, now: float) -> bool:
+        """Returns whether the maintenance window is open and the maintenance not yet run in it."""
+        if not self._maintenance_window:
+            return False
+        if now - self._stored.last_maintenance_time < MAINTENANCE_INTERVAL:
+            return False
+        start, end = _parse_maintenance_window(self._maintenance_window)
+        current = time.gmtime(now)
+        minutes = current.tm_hour * 60 + current.tm_min
+        # The window may span midnight, e.g. 23:00-01:00
+        return start <= minutes < end if start <= end else minutes >= start or minutes < end
+
+    def _run_scheduled_maintenance(self):
+        """Collects garbage and optimizes the database once a day, within the maintenance window.
+
+        Both steps are bounded by MAINTENANCE_GC_DEFAULTS and MAINTENANCE_DEFAULTS.  A failed
+        run is reported by get_status() until optimize() next succeeds, and only retried in the
+        next window rather than on every reconcile.
+        """
+        now = time.time()
+        if not self._is_maintenance_due(now):
+            return
+        self._stored.last_maintenance_time = now
+        try:
+            if self._retention_days:
+                self.collect_garbage(
+                    retention_days=self._retention_days, **MAINTENANCE_GC_DEFAULTS
+                )
+            self.optimize(**MAINTENANCE_DEFAULTS)
+        except SqliteStoreError as err:
+            logger.error(f"Scheduled SQLite maintenance failed: {err}")
+            self._stored.last_maintenance_error = str(err)
+
+    def _validate(self):
+        """Raises an ErrorWithStatus if the configuration is invalid."""
+        if self._journal_mode not in SQLITE_JOURNAL_MODES:
+            raise ErrorWithStatus(
+                f"Invalid sqlite-journal-mode '{self._journal_mode}', expected one of"
+                f" {', '.join(SQLITE_JOURNAL_MODES)}",
+                BlockedStatus,
+            )
+        if self._maintenance_window and not re.match(
+            MAINTENANCE_WINDOW_REGEX, self._maintenance_window
+        ):
+            raise ErrorWithStatus(
+                f"Invalid sqlite-maintenance-window '{self._maintenance_window}', expected"
+                " HH:MM-HH:MM",
+                BlockedStatus,
+            )
+        if self._retention_days < 0:
+            raise ErrorWithStatus(
+                f"Invalid sqlite-retention-days {self._retention_days}, expected 0 or more",
+                BlockedStatus,
+            )
+
+    def _configure_app_leader(self, event):
+        """Sets the configured journal mode, then runs the maintenance if it is due."""
+        self._validate()
+        if not self._enabled():
+            return
+
+        database_path = self.database_path
+        # The metadata_store_server creates the database on its first start.  Creating it here
+        # would leave it owned by the charm user, so wait until the workload has done so.
+        if database_path is None or not database_path.exists():
+            logger.info("SQLite database not created yet - skipping its configuration.")
+            return
+
+        try:
+            self._share_database(database_path)
+            self._set_journal_mode(database_path)
+        except SqliteStoreError as err:
+            logger.error(f"Failed to configure the SQLite database: {err}")
+            self._configuration_error = str(err)
+            return
+        self._run_scheduled_maintenance()
+
+    def _set_journal_mode(self, database_path: Path):
+        """Sets the configured journal mode on the database if it differs from the current one.
+
+        Raises:
+            SqliteStoreError: if the journal mode cannot be set
+        """
+        try:
+            with closing(sqlite3.connect(database_path, timeout=5)) as connection:
+                (current,) = connection.execute("PRAGMA journal_mode").fetchone()
+                if current == self._journal_mode:
+                    return
+                (applied,) = connection.execute(
+                    f"PRAGMA journal_mode={self._journal_mode}"
+                ).fetchone()
+        except sqlite3.Error as err:
+            raise SqliteStoreError(
+                f"Failed to set the journal mode of {database_path.name}: {err}"
+            ) from err
+
+        logger.info(f"SQLite journal mode changed from {current} to {applied}.")
+
+    def get_status(self) -> StatusBase:
+        """Returns the status of this Component."""
+        try:
+            self._validate()
+        except ErrorWithStatus as err:
+            return err.status
+        if self._configuration_error:
+            return BlockedStatus(self._configuration_error)
+        if self._enabled() and self._maintenance_window and self._stored.last_maintenance_error:
+            return BlockedStatus(
+                "Scheduled SQLite maintenance failed, see the logs or run optimize-db"
+            )
+        return ActiveStatus()
@@ -0,0 +1,102 @@
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import json
+import logging
+from typing import Callable, Dict, List, Optional
+
+import lightkube
+from charmed_kubeflow_chisme.components.component import Component
+from lightkube.core.exceptions import ApiError
+from lightkube.resources.core_v1 import Pod
+from lightkube.types import PatchType
+from ops import ActiveStatus, StatusBase, StoredState
+
+logger = logging.getLogger(__name__)
+
+PRE_BACKUP_HOOK_ANNOTATION_PREFIX = "pre.hook.backup.velero.io"
+
+
+class VeleroBackupHooksComponent(Component):
+    """Annotates the pod of the unit with a Velero pre-backup hook.
+
+    Velero runs the command set in the pre.hook.backup.velero.io annotations of a pod before
+    backing it up, so volumes are snapshotted right after the workload has flushed its data.
+    The annotations are set on the pod directly, as Juju owns the StatefulSet, and set again
+    when the pod is re-created.  A failing hook fails the backup, rather than let it hold data
+    the command was meant to flush.
+
+    The annotations last patched are kept in StoredState, so the pod is only read again when the
+    desired annotations change.  The charm state lives in the pod, so a re-created pod starts
+    with an empty cache and is patched again.
+    """
+
+    _stored = StoredState()
+
+    def __init__(
+        self,
+        *args,
+        container_name: str,
+        command: Callable[[], Optional[List[str]]],
+        timeout: str,
+        lightkube_client_getter: Callable[[], lightkube.Client],
+        **kwargs,
+    ):
+        """Instantiate the VeleroBackupHooksComponent.
+
+        Args:
+            container_name: the name of the container of the pod the command is run in
+            command: a function returning the command run before a backup, or None if no hook
+                     is needed.  When it returns None, any previously set hook is removed.
+            timeout: how long Velero waits for the command to complete, e.g. "30s"
+            lightkube_client_getter: a function returning the lightkube Client to use
+        """
+        super().__init__(*args, **kwargs)
+        self._container_name = container_name
+        self._command = command
+        self._timeout = timeout
+        self._lightkube_client_getter = lightkube_client_getter
+        self._stored.set_default(applied_annotations="")
+
+    def get_annotations(self) -> Dict[str, Optional[str]]:
+        """Returns the hook annotations of the pod, set to None if the hook should be removed."""
+        command = self._command()
+        annotations = {
+            "container": self._container_name,
+            "command": json.dumps(command),
+            "on-error": "Fail",
+            "timeout": self._timeout,
+        }
+        return {
+            f"{PRE_BACKUP_HOOK_ANNOTATION_PREFIX}/{key}": value if command else None
+            for key, value in annotations.items()
+        }
+
+    def _configure_unit(self, event):
+        """Patches the annotations of the pod of this unit if they differ from the desired ones."""
+        annotations = self.get_annotations()
+        serialized_annotations = json.dumps(annotations, sort_keys=True)
+        if self._stored.applied_annotations == serialized_annotations:
+            return
+        pod_name = self._charm.unit.name.replace("/", "-")
+        client = self._lightkube_client_getter()
+        try:
+            pod = client.get(Pod, name=pod_name, namespace=self._charm.model.name)
+            current = pod.metadata.annotations or {}
+            if any(current.get(key) != value for key, value in annotations.items()):
+                client.patch(
+                    Pod,
+                    name=pod_name,
+                    obj={"metadata": {"annotations": annotations}},
+                    namespace=self._charm.model.name,
+                    patch_type=PatchType.MERGE,
+                )
+                logger.info(f"Velero backup hooks of pod {pod_name} updated.")
+        except ApiError as err:
+            logger.warning(f"Failed to set the Velero backup hooks on pod {pod_name}: {err}")
+            return
+        self._stored.applied_annotations = serialized_annotations
+
+    def get_status(self) -> StatusBase:
+        """Returns the status of this Component."""
+        return ActiveStatus()
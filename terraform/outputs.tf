@@ -10,6 +10,8 @@ output "provides" {
 
 output "requires" {
   value = {
-    logging = "logging"
+    logging       = "logging",
+    mysql-db      = "mysql-db",
+    postgresql-db = "postgresql-db",
   }
 }
@@ -10,9 +10,9 @@ from charm import Operator
 
 
 @pytest.fixture(autouse=True)
-def patch_kubernetes_service_patch(mocker):
-    """Patch KubernetesServicePatch to avoid actual Kubernetes interactions."""
-    mocker.patch("charm.KubernetesServicePatch")
+def patch_lightkube_client(mocker):
+    """Patch the lightkube Client to avoid actual Kubernetes interactions."""
+    mocker.patch("charm.lightkube.Client")
 
 
 @pytest.fixture
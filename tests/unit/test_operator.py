@@ -1,17 +1,63 @@
 # Copyright 2024 Canonical Ltd.
 # See LICENSE file for licensing details.
 
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import closing, contextmanager
+from pathlib import Path
+from typing import List
 from unittest.mock import MagicMock, patch
 
 import pytest
-from ops.model import ActiveStatus, WaitingStatus
-from ops.testing import Harness
+from lightkube.core.exceptions import ApiError
+from lightkube.models.meta_v1 import Status
+from lightkube.resources.core_v1 import Pod
+from ops.model import ActiveStatus, BlockedStatus, WaitingStatus
+from ops.pebble import CheckInfo, CheckLevel, CheckStatus, Plan
+from ops.testing import ActionFailed, ExecResult, Harness
 
-from charm import GRPC_SVC_NAME, RELATION_NAME, Operator
+from charm import (
+    CONFIG_PROTO_DESTINATION,
+    DATABASE_NAME,
+    GRPC_SVC_NAME,
+    MYSQL_RELATION_NAME,
+    PEER_RELATION_NAME,
+    POSTGRESQL_RELATION_NAME,
+    RELATION_NAME,
+    SQLITE_DATABASE_FILE,
+    STORAGE_NAME,
+    Operator,
+)
+from components.sqlite_components import SqliteStoreError
 
 CONTAINER_NAME = "mlmd-grpc-server"
 SERVICE_NAME = "mlmd"
 MODEL_NAME = "mlmd-test"
+# Subset of the MLMD schema used by garbage collection
+MLMD_SCHEMA = """
+CREATE TABLE Execution (id INTEGER PRIMARY KEY, last_update_time_since_epoch INTEGER);
+CREATE TABLE ExecutionProperty (execution_id INTEGER);
+CREATE TABLE Artifact (id INTEGER PRIMARY KEY, last_update_time_since_epoch INTEGER);
+CREATE TABLE ArtifactProperty (artifact_id INTEGER);
+CREATE TABLE Context (id INTEGER PRIMARY KEY, last_update_time_since_epoch INTEGER);
+CREATE TABLE ContextProperty (context_id INTEGER);
+CREATE TABLE ParentContext (context_id INTEGER, parent_context_id INTEGER);
+CREATE TABLE Event (id INTEGER PRIMARY KEY, artifact_id INTEGER, execution_id INTEGER);
+CREATE TABLE EventPath (event_id INTEGER);
+CREATE TABLE Association (id INTEGER PRIMARY KEY, context_id INTEGER, execution_id INTEGER);
+CREATE TABLE Attribution (id INTEGER PRIMARY KEY, context_id INTEGER, artifact_id INTEGER);
+"""
+# uid and gid of the charm user with charm-user: non-root, and of the workload container
+CHARM_UID = 170
+WORKLOAD_UID = 584792
+
+requires_root = pytest.mark.skipif(os.geteuid() != 0, reason="switching users requires root")
 
 
 def test_log_forwarding(harness, mocked_lightkube_client):
@@ -28,9 +74,45 @@ def test_not_leader(
     """Test that charm waits for leadership."""
     harness.begin_with_initial_hooks()
     assert harness.charm.model.unit.status == WaitingStatus(
-        "[leadership-gate] Waiting for leadership"
+        "[workload-gate] Waiting for leadership"
+    )
+
+
+def test_non_leader_runs_workload_with_external_database(harness, mocked_lightkube_client):
+    """Test that non-leader units run the server when an external database is related."""
+    harness.begin()
+    harness.set_can_connect(CONTAINER_NAME, True)
+    rel_id = harness.add_relation(
+        MYSQL_RELATION_NAME,
+        "mysql-k8s",
+        app_data={"endpoints": "mysql:3306", "username": "user", "password": "secret"},
     )
 
+    harness.charm.on.install.emit()
+
+    container = harness.charm.unit.get_container(CONTAINER_NAME)
+    assert container.get_service(SERVICE_NAME).is_running()
+    assert isinstance(harness.charm.unit.status, ActiveStatus)
+    # Only the leader requests the database and manages the Kubernetes resources
+    assert harness.get_relation_data(rel_id, harness.charm.app.name) == {}
+    mocked_lightkube_client.apply.assert_not_called()
+    # Only the leader migrates the shared database schema
+    command = container.get_plan().services[SERVICE_NAME].command
+    assert "--enable_database_upgrade=false" in command
+
+
+@pytest.mark.parametrize("leader, expected", [(True, "true"), (False, "false")])
+def test_database_upgrade_enabled_on_leader_only(
+    harness, mocked_lightkube_client, leader, expected
+):
+    """Test that only the leader starts the server with the database schema upgrade."""
+    harness.set_leader(leader)
+    harness.begin()
+
+    command = harness.charm.mlmd_container.component.get_layer().services[SERVICE_NAME].command
+
+    assert f"--enable_database_upgrade={expected}" in command.split()
+
 
 def test_grpc_relation_with_data(harness, mocked_lightkube_client):
     """Test the relation data has values by default as the charm is broadcasting them."""
@@ -62,7 +144,7 @@ def test_grpc_relation_with_data_when_data_changes(
     harness.begin()
 
     # Initialise a k8s-service requirer charm
-    harness.charm.leadership_gate.get_status = MagicMock(return_value=ActiveStatus())
+    harness.charm.workload_gate.get_status = MagicMock(return_value=ActiveStatus())
     harness.charm.kubernetes_resources.get_status = MagicMock(return_value=ActiveStatus())
 
     # Add relation between the requirer charm and this charm (mlmd)
@@ -75,24 +157,175 @@ def test_grpc_relation_with_data_when_data_changes(
     assert provider_rel_data["port"] == harness.model.config["port"]
 
 
+def test_grpc_relation_unit_endpoints_published_when_headless(harness, mocked_lightkube_client):
+    """Test that every unit with a ready workload is published on the relation when headless."""
+    harness.set_leader(True)
+    harness.update_config({"headless-service": True})
+    harness.begin()
+    harness.set_can_connect(CONTAINER_NAME, True)
+    harness.add_relation(
+        MYSQL_RELATION_NAME,
+        "mysql-k8s",
+        app_data={"endpoints": "mysql:3306", "username": "user", "password": "secret"},
+    )
+    peer_rel_id = harness.add_relation(PEER_RELATION_NAME, harness.charm.app.name)
+    harness.add_relation_unit(peer_rel_id, "mlmd/1")
+    harness.add_relation_unit(peer_rel_id, "mlmd/2")
+    harness.update_relation_data(peer_rel_id, "mlmd/1", {"workload-ready": "true"})
+    rel_id = harness.add_relation(RELATION_NAME, "app")
+
+    harness.charm.on.config_changed.emit()
+
+    rel_data = harness.get_relation_data(rel_id, harness.charm.app.name)
+    assert rel_data["name"] == GRPC_SVC_NAME
+    # mlmd/2 has not advertised a ready workload yet
+    assert rel_data["endpoints"] == ",".join(
+        f"mlmd-{i}.mlmd-endpoints.{MODEL_NAME}.svc:{harness.model.config['port']}"
+        for i in range(2)
+    )
+    assert harness.get_relation_data(peer_rel_id, "mlmd/0") == {"workload-ready": "true"}
+
+    harness.update_config({"headless-service": False})
+
+    assert "endpoints" not in harness.get_relation_data(rel_id, harness.charm.app.name)
+
+
+def test_unit_workload_readiness_advertised_to_peers(harness, mocked_lightkube_client):
+    """Test that a unit only advertises its workload as ready while the server is running."""
+    harness.begin()
+    peer_rel_id = harness.add_relation(PEER_RELATION_NAME, harness.charm.app.name)
+    harness.update_relation_data(peer_rel_id, "mlmd/0", {"workload-ready": "true"})
+
+    # Without an external database, only the leader runs the server
+    harness.charm.on.config_changed.emit()
+
+    assert harness.get_relation_data(peer_rel_id, "mlmd/0") == {}
+
+
 def test_kubernetes_component_created(harness, mocked_lightkube_client):
     """Test that Kubernetes component is created when we have leadership."""
     # Needed because the kubernetes component will only apply to k8s if we are the leader
     harness.set_leader(True)
     harness.begin()
 
-    # Need to mock the leadership-gate to be active, and the kubernetes auth component so that it
-    # sees the expected resources when calling _get_missing_kubernetes_resources
-    kubernetes_resources = harness.charm.kubernetes_resources
-    kubernetes_resources.component._get_missing_kubernetes_resources = MagicMock(return_value=[])
-
     harness.charm.on.install.emit()
 
     assert isinstance(harness.charm.kubernetes_resources.status, ActiveStatus)
 
-    # Assert that expected amount of apply calls were made
+    # Assert that expected amount of apply calls were made, one for the application Service
+    # and one for the metadata-grpc-service
     # This simulates the Kubernetes resources being created
-    assert mocked_lightkube_client.apply.call_count == 1
+    assert mocked_lightkube_client.apply.call_count == 2
+
+
+def test_kubernetes_apply_skipped_when_up_to_date(harness, mocked_lightkube_client):
+    """Test that resources already deployed with the same hash and spec are not re-applied."""
+    harness.set_leader(True)
+    harness.begin()
+    component = harness.charm.kubernetes_resources.component
+    mocked_lightkube_client.list.return_value = (
+        component._get_kubernetes_resource_handler().render_manifests()
+    )
+
+    harness.charm.on.install.emit()
+
+    mocked_lightkube_client.apply.assert_not_called()
+
+
+def test_kubernetes_apply_on_drift(harness, mocked_lightkube_client):
+    """Test that a deployed resource edited out of band is re-applied despite its hash."""
+    harness.set_leader(True)
+    harness.begin()
+    component = harness.charm.kubernetes_resources.component
+    deployed = component._get_kubernetes_resource_handler().render_manifests()
+    deployed[0].spec.ports[0].targetPort = 9999
+    mocked_lightkube_client.list.return_value = deployed
+
+    harness.charm.on.install.emit()
+
+    assert mocked_lightkube_client.apply.call_count == 2
+
+
+def test_kubernetes_resources_listed_once_per_hook(harness, mocked_lightkube_client):
+    """Test that the status reuses the resources listed to detect drift in the same hook."""
+    harness.set_leader(True)
+    harness.begin()
+    component = harness.charm.kubernetes_resources.component
+    mocked_lightkube_client.list.return_value = (
+        component._get_kubernetes_resource_handler().render_manifests()
+    )
+
+    harness.charm.on.update_status.emit()
+
+    assert mocked_lightkube_client.list.call_count == 1
+    assert isinstance(harness.charm.kubernetes_resources.status, ActiveStatus)
+    assert mocked_lightkube_client.list.call_count == 1
+
+
+def test_kubernetes_resources_missing_blocks(harness, mocked_lightkube_client):
+    """Test that the status is Blocked when a resource is missing without being applied."""
+    harness.set_leader(True)
+    harness.begin()
+    mocked_lightkube_client.list.return_value = []
+
+    assert isinstance(harness.charm.kubernetes_resources.component.get_status(), BlockedStatus)
+
+
+def test_headless_service_recreated(harness, mocked_lightkube_client):
+    """Test that enabling headless-service re-creates the metadata-grpc-service headless."""
+    harness.set_leader(True)
+    harness.begin()
+    component = harness.charm.kubernetes_resources.component
+    deployed = component._get_kubernetes_resource_handler().render_manifests()
+    for service in deployed:
+        service.spec.clusterIP = "10.152.183.10"
+    mocked_lightkube_client.list.return_value = deployed
+
+    harness.update_config({"headless-service": True})
+
+    desired = component._get_kubernetes_resource_handler().render_manifests()
+    assert [service.spec.clusterIP for service in desired] == [None, "None"]
+    deleted = [call.kwargs["name"] for call in mocked_lightkube_client.delete.call_args_list]
+    assert deleted == [GRPC_SVC_NAME]
+    assert mocked_lightkube_client.apply.call_count == 2
+
+
+def test_remove_keeps_application_service(harness, mocked_lightkube_client):
+    """Test that removal deletes the managed Services but leaves the Juju-created one."""
+    harness.set_leader(True)
+    harness.begin()
+    component = harness.charm.kubernetes_resources.component
+    mocked_lightkube_client.list.return_value = (
+        component._get_kubernetes_resource_handler().render_manifests()
+    )
+
+    harness.charm.on.remove.emit()
+
+    deleted = [call.kwargs["name"] for call in mocked_lightkube_client.delete.call_args_list]
+    assert deleted == [GRPC_SVC_NAME]
+
+
+def test_lightkube_client_created_lazily_and_shared(harness):
+    """Test that the lightkube Client is only created when needed, and only once."""
+    harness.set_leader(True)
+    with patch("charm.lightkube.Client") as mocked_client_class:
+        harness.begin()
+        mocked_client_class.assert_not_called()
+        harness.charm.on.install.emit()
+        harness.charm.on.config_changed.emit()
+
+        mocked_client_class.assert_called_once_with()
+
+
+def test_lightkube_client_not_created_on_non_leader(harness):
+    """Test that non-leader units never create the lightkube Client."""
+    with patch("charm.lightkube.Client") as mocked_client_class:
+        harness.begin()
+        harness.charm.on.install.emit()
+        harness.charm.on.config_changed.emit()
+        harness.charm.on.update_status.emit()
+
+        mocked_client_class.assert_not_called()
 
 
 def test_pebble_service_container_running(harness, mocked_lightkube_client):
@@ -127,23 +360,1147 @@ def test_install_before_pebble_service_container(harness, mocked_lightkube_clien
     )
 
 
+def test_config_proto_defaults_to_sqlite(harness, mocked_lightkube_client):
+    """Test that the SQLite connection_config is pushed when no database is related."""
+    harness.set_leader(True)
+    harness.begin()
+    harness.set_can_connect(CONTAINER_NAME, True)
+    harness.charm.kubernetes_resources.get_status = MagicMock(return_value=ActiveStatus())
+
+    harness.charm.on.install.emit()
+
+    container = harness.charm.unit.get_container(CONTAINER_NAME)
+    config_proto = container.pull(CONFIG_PROTO_DESTINATION).read()
+    assert 'sqlite: {filename_uri: "file:/data/mlmd.db"}' in config_proto
+    assert "mysql" not in config_proto
+
+
+def test_mysql_relation_requests_database(harness, mocked_lightkube_client):
+    """Test that the leader requests the database and waits for credentials."""
+    harness.set_leader(True)
+    harness.begin()
+    harness.charm.kubernetes_resources.get_status = MagicMock(return_value=ActiveStatus())
+
+    rel_id = harness.add_relation(MYSQL_RELATION_NAME, "mysql-k8s")
+    harness.add_relation_unit(rel_id, "mysql-k8s/0")
+    harness.charm.on.install.emit()
+
+    assert harness.get_relation_data(rel_id, harness.charm.app.name) == {"database": DATABASE_NAME}
+    assert harness.charm.mysql_database.status == WaitingStatus(
+        "Waiting for endpoints, username, password on relation mysql-db"
+    )
+
+
+def test_mysql_relation_renders_connection_config(harness, mocked_lightkube_client):
+    """Test that the MySQL connection_config is pushed when the provider shares credentials."""
+    harness.set_leader(True)
+    harness.begin()
+    harness.set_can_connect(CONTAINER_NAME, True)
+    harness.charm.kubernetes_resources.get_status = MagicMock(return_value=ActiveStatus())
+
+    harness.add_relation(
+        MYSQL_RELATION_NAME,
+        "mysql-k8s",
+        app_data={
+            "endpoints": "mysql-k8s-primary:3306",
+            "username": "relation-1",
+            "password": "secret",
+            "database": DATABASE_NAME,
+        },
+    )
+    harness.charm.on.install.emit()
+
+    container = harness.charm.unit.get_container(CONTAINER_NAME)
+    config_proto = container.pull(CONFIG_PROTO_DESTINATION).read()
+    assert "sqlite" not in config_proto
+    assert 'host: "mysql-k8s-primary"' in config_proto
+    assert "port: 3306" in config_proto
+    assert f'database: "{DATABASE_NAME}"' in config_proto
+    assert 'user: "relation-1"' in config_proto
+    assert 'password: "secret"' in config_proto
+    assert isinstance(harness.charm.unit.status, ActiveStatus)
+
+
+def test_connection_config_escapes_credentials(harness, mocked_lightkube_client):
+    """Test that credentials are escaped in config.proto, and the file is private."""
+    harness.set_leader(True)
+    harness.begin()
+    harness.set_can_connect(CONTAINER_NAME, True)
+    harness.charm.kubernetes_resources.get_status = MagicMock(return_value=ActiveStatus())
+
+    harness.add_relation(
+        MYSQL_RELATION_NAME,
+        "mysql-k8s",
+        app_data={"endpoints": "mysql:3306", "username": "user", "password": 'p"a\\ss'},
+    )
+    harness.charm.on.install.emit()
+
+    container = harness.charm.unit.get_container(CONTAINER_NAME)
+    assert 'password: "p\\"a\\\\ss"' in container.pull(CONFIG_PROTO_DESTINATION).read()
+    (config_proto_info,) = container.list_files(CONFIG_PROTO_DESTINATION)
+    assert config_proto_info.permissions == 0o600
+
+
+def test_mysql_relation_credentials_from_secret(harness, mocked_lightkube_client, monkeypatch):
+    """Test that credentials shared by the provider as a Juju secret are rendered."""
+    monkeypatch.setenv("JUJU_VERSION", "3.6.0")
+    harness.set_leader(True)
+    harness.begin()
+    harness.set_can_connect(CONTAINER_NAME, True)
+    harness.charm.kubernetes_resources.get_status = MagicMock(return_value=ActiveStatus())
+
+    rel_id = harness.add_relation(MYSQL_RELATION_NAME, "mysql-k8s")
+    secret_id = harness.add_model_secret(
+        "mysql-k8s", {"username": "relation-1", "password": "from-secret"}
+    )
+    harness.grant_secret(secret_id, harness.charm.app.name)
+    harness.update_relation_data(
+        rel_id, "mysql-k8s", {"endpoints": "mysql:3306", "secret-user": secret_id}
+    )
+    harness.charm.on.install.emit()
+
+    assert "requested-secrets" in harness.get_relation_data(rel_id, harness.charm.app.name)
+    container = harness.charm.unit.get_container(CONTAINER_NAME)
+    assert 'password: "from-secret"' in container.pull(CONFIG_PROTO_DESTINATION).read()
+
+
+def test_postgresql_relation_renders_connection_config(harness, mocked_lightkube_client):
+    """Test that the PostgreSQL connection_config is pushed when the provider shares credentials."""
+    harness.set_leader(True)
+    harness.begin()
+    harness.set_can_connect(CONTAINER_NAME, True)
+    harness.charm.kubernetes_resources.get_status = MagicMock(return_value=ActiveStatus())
+
+    harness.add_relation(
+        POSTGRESQL_RELATION_NAME,
+        "postgresql-k8s",
+        app_data={
+            "endpoints": "postgresql-k8s-primary.mlmd-test.svc.cluster.local:5432",
+            "username": "relation-2",
+            "password": "secret",
+            "database": DATABASE_NAME,
+        },
+    )
+    harness.charm.on.install.emit()
+
+    container = harness.charm.unit.get_container(CONTAINER_NAME)
+    config_proto = container.pull(CONFIG_PROTO_DESTINATION).read()
+    assert "sqlite" not in config_proto
+    assert 'host: "postgresql-k8s-primary.mlmd-test.svc.cluster.local"' in config_proto
+    assert 'port: "5432"' in config_proto
+    assert f'dbname: "{DATABASE_NAME}"' in config_proto
+    assert 'user: "relation-2"' in config_proto
+    assert isinstance(harness.charm.unit.status, ActiveStatus)
+
+
+def test_multiple_database_backends_blocked(harness, mocked_lightkube_client):
+    """Test that relating both MySQL and PostgreSQL blocks the charm."""
+    harness.set_leader(True)
+    harness.begin()
+    harness.set_can_connect(CONTAINER_NAME, True)
+    harness.charm.kubernetes_resources.get_status = MagicMock(return_value=ActiveStatus())
+
+    harness.add_relation(MYSQL_RELATION_NAME, "mysql-k8s")
+    harness.add_relation(POSTGRESQL_RELATION_NAME, "postgresql-k8s")
+    harness.charm.on.install.emit()
+
+    assert harness.charm.mysql_database.status == BlockedStatus(
+        "Relation mysql-db cannot be used together with postgresql-db"
+    )
+    assert isinstance(harness.charm.unit.status, BlockedStatus)
+
+
+@contextmanager
+def _as_user(uid: int, groups: List[int]):
+    """Runs the test process with the effective uid, gid and groups of another user."""
+    previous = os.geteuid(), os.getegid(), os.getgroups()
+    os.seteuid(0)
+    os.setgroups(groups)
+    os.setegid(groups[0])
+    os.seteuid(uid)
+    try:
+        yield
+    finally:
+        os.seteuid(0)
+        os.setgroups(previous[2])
+        os.setegid(previous[1])
+        os.seteuid(previous[0])
+
+
+def _exec_as_workload_user(args) -> ExecResult:
+    """Runs a command of a Pebble exec in the workload container as the workload user."""
+    with _as_user(0, [0]):
+        result = subprocess.run(
+            args.command,
+            user=WORKLOAD_UID,
+            group=WORKLOAD_UID,
+            extra_groups=[CHARM_UID],
+            capture_output=True,
+            text=True,
+        )
+    return ExecResult(exit_code=result.returncode, stdout=result.stdout, stderr=result.stderr)
+
+
+def _create_workload_database(harness, schema: str) -> Path:
+    """Creates the database as the workload does, in storage shared like a Kubernetes volume.
+
+    The volume belongs to the group of the charm user, with the setgid bit, as with a pod
+    fsGroup that both users are a member of.  SQLite creates the database with mode 0644.
+    """
+    location = Path(harness.model.storages[STORAGE_NAME][0].location)
+    for parent in location.parents:
+        if parent == Path(tempfile.gettempdir()):
+            break
+        parent.chmod(parent.stat().st_mode | 0o111)
+    os.chown(location, 0, CHARM_UID)
+    location.chmod(0o2770)
+    database_path = location / SQLITE_DATABASE_FILE
+    with _as_user(WORKLOAD_UID, [WORKLOAD_UID, CHARM_UID]):
+        with closing(sqlite3.connect(database_path)) as connection:
+            connection.executescript(schema)
+            connection.commit()
+    return database_path
+
+
+@requires_root
+def test_sqlite_journal_mode_applied_to_database_of_workload_user(
+    harness, mocked_lightkube_client
+):
+    """Test that the charm user sets WAL on the database created by the workload user."""
+    harness.set_leader(True)
+    harness.update_config({"sqlite-journal-mode": "wal"})
+    harness.add_storage(STORAGE_NAME, attach=True)
+    harness.begin()
+    harness.set_can_connect(CONTAINER_NAME, True)
+    harness.handle_exec(CONTAINER_NAME, ["chgrp"], handler=_exec_as_workload_user)
+    harness.handle_exec(CONTAINER_NAME, ["chmod"], handler=_exec_as_workload_user)
+    database_path = _create_workload_database(harness, "CREATE TABLE Type (id INTEGER);")
+    component = harness.charm.sqlite_store.component
+
+    with _as_user(CHARM_UID, [CHARM_UID]):
+        component.configure_charm(None)
+
+    assert component.get_status() == ActiveStatus()
+    # The workload keeps writing the database, and the WAL the charm user created
+    with _as_user(WORKLOAD_UID, [WORKLOAD_UID, CHARM_UID]):
+        with closing(sqlite3.connect(database_path)) as connection:
+            assert connection.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+            connection.execute("INSERT INTO Type VALUES (1)")
+            connection.commit()
+
+
+@requires_root
+def test_sqlite_journal_mode_blocked_when_database_not_writable(harness, mocked_lightkube_client):
+    """Test that the charm is blocked when the workload cannot share the database with it."""
+    harness.set_leader(True)
+    harness.update_config({"sqlite-journal-mode": "wal"})
+    harness.add_storage(STORAGE_NAME, attach=True)
+    harness.begin()
+    harness.set_can_connect(CONTAINER_NAME, True)
+    harness.handle_exec(
+        CONTAINER_NAME, ["chgrp"], result=ExecResult(exit_code=1, stderr="not permitted")
+    )
+    database_path = _create_workload_database(harness, "CREATE TABLE Type (id INTEGER);")
+    component = harness.charm.sqlite_store.component
+
+    with _as_user(CHARM_UID, [CHARM_UID]):
+        component.configure_charm(None)
+
+    assert isinstance(component.get_status(), BlockedStatus)
+    assert "Failed to make mlmd.db writable by the charm" in component.get_status().message
+    with closing(sqlite3.connect(database_path)) as connection:
+        assert connection.execute("PRAGMA journal_mode").fetchone() == ("delete",)
+
+
+def test_sqlite_journal_mode_applied(harness, mocked_lightkube_client):
+    """Test that the configured journal mode is set on an existing SQLite database."""
+    harness.set_leader(True)
+    harness.update_config({"sqlite-journal-mode": "wal"})
+    harness.add_storage(STORAGE_NAME, attach=True)
+    harness.begin()
+    harness.set_can_connect(CONTAINER_NAME, True)
+    harness.charm.kubernetes_resources.get_status = MagicMock(return_value=ActiveStatus())
+
+    database_path = Path(harness.model.storages[STORAGE_NAME][0].location) / SQLITE_DATABASE_FILE
+    with closing(sqlite3.connect(database_path)) as connection:
+        connection.execute("CREATE TABLE Type (id INTEGER PRIMARY KEY)")
+
+    harness.charm.on.install.emit()
+
+    with closing(sqlite3.connect(database_path)) as connection:
+        assert connection.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+    assert isinstance(harness.charm.unit.status, ActiveStatus)
+
+
+def test_sqlite_journal_mode_invalid(harness, mocked_lightkube_client):
+    """Test that an unsupported journal mode blocks the charm."""
+    harness.set_leader(True)
+    harness.update_config({"sqlite-journal-mode": "off"})
+    harness.begin()
+    harness.set_can_connect(CONTAINER_NAME, True)
+    harness.charm.kubernetes_resources.get_status = MagicMock(return_value=ActiveStatus())
+
+    harness.charm.on.install.emit()
+
+    assert harness.charm.unit.status == BlockedStatus(
+        "[sqlite-store] Invalid sqlite-journal-mode 'off', expected one of delete, truncate,"
+        " persist, wal"
+    )
+
+
+def test_get_db_stats_action(harness, mocked_lightkube_client):
+    """Test that the get-db-stats action reports the size and row counts of the database."""
+    harness.set_leader(True)
+    harness.add_storage(STORAGE_NAME, attach=True)
+    harness.begin()
+
+    database_path = Path(harness.model.storages[STORAGE_NAME][0].location) / SQLITE_DATABASE_FILE
+    with closing(sqlite3.connect(database_path)) as connection:
+        connection.execute("CREATE TABLE Artifact (id INTEGER PRIMARY KEY)")
+        connection.execute("CREATE TABLE EventPath (event_id INTEGER)")
+        connection.executemany("INSERT INTO Artifact VALUES (?)", [(i,) for i in range(3)])
+        connection.commit()
+
+    with patch("components.sqlite_components.time.time", side_effect=[1000.0, 4600.0]):
+        first = harness.run_action("get-db-stats").results
+        with closing(sqlite3.connect(database_path)) as connection:
+            connection.execute("CREATE TABLE Padding (data BLOB)")
+            connection.execute("INSERT INTO Padding VALUES (zeroblob(16384))")
+            connection.commit()
+        second = harness.run_action("get-db-stats").results
+
+    assert first["page-count"] * first["page-size"] == first["file-size"]
+    assert first["freelist-count"] == 0
+    assert first["wal-size"] == 0
+    assert first["rows"] == {"artifact": 3, "event-path": 0}
+    assert "growth-bytes-per-hour" not in first
+    assert second["growth-bytes-per-hour"] == second["file-size"] - first["file-size"]
+
+
+@requires_root
+def test_get_db_stats_action_on_wal_database_of_workload_user(harness, mocked_lightkube_client):
+    """Test that reading the WAL database as the charm user leaves it writable by the workload."""
+    harness.set_leader(True)
+    harness.add_storage(STORAGE_NAME, attach=True)
+    harness.begin()
+    harness.set_can_connect(CONTAINER_NAME, True)
+    harness.handle_exec(CONTAINER_NAME, ["chgrp"], handler=_exec_as_workload_user)
+    harness.handle_exec(CONTAINER_NAME, ["chmod"], handler=_exec_as_workload_user)
+    database_path = _create_workload_database(
+        harness, "PRAGMA journal_mode=wal; CREATE TABLE Artifact (id INTEGER PRIMARY KEY);"
+    )
+
+    # With no connection open, the read creates the WAL and shm files as the charm user
+    with _as_user(CHARM_UID, [CHARM_UID]):
+        results = harness.run_action("get-db-stats").results
+
+    assert results["rows"] == {"artifact": 0}
+    with _as_user(WORKLOAD_UID, [WORKLOAD_UID, CHARM_UID]):
+        with closing(sqlite3.connect(database_path)) as connection:
+            connection.execute("INSERT INTO Artifact VALUES (1)")
+            connection.commit()
+
+
+def test_get_db_stats_action_fails_with_external_database(harness, mocked_lightkube_client):
+    """Test that the get-db-stats action fails when SQLite is not the active backend."""
+    harness.set_leader(True)
+    harness.add_storage(STORAGE_NAME, attach=True)
+    harness.begin()
+    harness.add_relation(MYSQL_RELATION_NAME, "mysql-k8s")
+
+    with pytest.raises(ActionFailed, match="SQLite is not in use"):
+        harness.run_action("get-db-stats")
+
+
+def test_collect_garbage_action(harness, mocked_lightkube_client):
+    """Test that collect-garbage deletes old runs and cascades to the rows referencing them."""
+    harness.set_leader(True)
+    harness.add_storage(STORAGE_NAME, attach=True)
+    harness.begin()
+
+    database_path = Path(harness.model.storages[STORAGE_NAME][0].location) / SQLITE_DATABASE_FILE
+    recent = int(time.time() * 1000)
+    with closing(sqlite3.connect(database_path)) as connection:
+        connection.executescript(MLMD_SCHEMA)
+        # Execution 1 is old and only used artifact 1 and run context 1, a child of context 3.
+        # Artifact 2 and pipeline context 2 are old but still used by the recent execution 2.
+        connection.executemany("INSERT INTO Execution VALUES (?, ?)", [(1, 0), (2, recent)])
+        connection.executemany("INSERT INTO Artifact VALUES (?, ?)", [(1, 0), (2, 0)])
+        connection.executemany("INSERT INTO Context VALUES (?, ?)", [(1, 0), (2, 0), (3, 0)])
+        connection.executemany(
+            "INSERT INTO Event VALUES (?, ?, ?)", [(1, 1, 1), (2, 2, 1), (3, 2, 2)]
+        )
+        connection.executemany("INSERT INTO EventPath VALUES (?)", [(1,), (2,), (3,)])
+        connection.executemany("INSERT INTO ExecutionProperty VALUES (?)", [(1,), (2,)])
+        connection.executemany("INSERT INTO ArtifactProperty VALUES (?)", [(1,), (2,)])
+        connection.executemany("INSERT INTO ContextProperty VALUES (?)", [(1,), (2,), (3,)])
+        connection.executemany(
+            "INSERT INTO Association VALUES (?, ?, ?)", [(1, 1, 1), (2, 2, 1), (3, 2, 2)]
+        )
+        connection.executemany("INSERT INTO Attribution VALUES (?, ?, ?)", [(1, 1, 1)])
+        connection.executemany("INSERT INTO ParentContext VALUES (?, ?)", [(1, 3), (1, 2)])
+        connection.commit()
+
+    results = harness.run_action(
+        "collect-garbage", {"retention-days": 30, "batch-size": 1, "batch-interval": 0}
+    ).results
+
+    assert results["deleted"] == {"executions": 1, "artifacts": 1, "contexts": 2}
+    with closing(sqlite3.connect(database_path)) as connection:
+        remaining = {
+            table: connection.execute(f"SELECT * FROM {table} ORDER BY 1").fetchall()
+            for table in ("Execution", "Artifact", "Context", "Event", "EventPath")
+        }
+        for table in ("ExecutionProperty", "ArtifactProperty", "ContextProperty"):
+            remaining[table] = connection.execute(f"SELECT * FROM {table}").fetchall()
+        for table in ("Association", "Attribution", "ParentContext"):
+            remaining[table] = connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()
+    assert remaining == {
+        "Execution": [(2, recent)],
+        "Artifact": [(2, 0)],
+        "Context": [(2, 0)],
+        "Event": [(3, 2, 2)],
+        "EventPath": [(3,)],
+        "ExecutionProperty": [(2,)],
+        "ArtifactProperty": [(2,)],
+        "ContextProperty": [(2,)],
+        "Association": (1,),
+        "Attribution": (0,),
+        "ParentContext": (0,),
+    }
+
+
+@requires_root
+def test_collect_garbage_action_on_database_of_workload_user(harness, mocked_lightkube_client):
+    """Test that the charm user deletes rows from the database created by the workload user."""
+    harness.set_leader(True)
+    harness.add_storage(STORAGE_NAME, attach=True)
+    harness.begin()
+    harness.set_can_connect(CONTAINER_NAME, True)
+    harness.handle_exec(CONTAINER_NAME, ["chgrp"], handler=_exec_as_workload_user)
+    harness.handle_exec(CONTAINER_NAME, ["chmod"], handler=_exec_as_workload_user)
+    database_path = _create_workload_database(
+        harness, MLMD_SCHEMA + "INSERT INTO Execution VALUES (1, 0), (2, 0);"
+    )
+
+    with _as_user(CHARM_UID, [CHARM_UID]):
+        results = harness.run_action(
+            "collect-garbage", {"retention-days": 30, "batch-size": 1, "batch-interval": 0}
+        ).results
+
+    assert results["deleted"] == {"executions": 2, "artifacts": 0, "contexts": 0}
+    with _as_user(WORKLOAD_UID, [WORKLOAD_UID, CHARM_UID]):
+        with closing(sqlite3.connect(database_path)) as connection:
+            assert connection.execute("SELECT COUNT(*) FROM Execution").fetchone() == (0,)
+            connection.execute("INSERT INTO Execution VALUES (3, 0)")
+            connection.commit()
+
+
+def test_collect_garbage_action_fails_with_external_database(harness, mocked_lightkube_client):
+    """Test that the collect-garbage action fails when SQLite is not the active backend."""
+    harness.set_leader(True)
+    harness.add_storage(STORAGE_NAME, attach=True)
+    harness.begin()
+    harness.add_relation(POSTGRESQL_RELATION_NAME, "postgresql-k8s")
+
+    with pytest.raises(ActionFailed, match="SQLite is not in use"):
+        harness.run_action("collect-garbage", {"retention-days": 30})
+
+
+def test_backup_db_action(harness, mocked_lightkube_client, tmp_path):
+    """Test that backup-db writes a consistent copy of the database and reports its size."""
+    harness.set_leader(True)
+    harness.add_storage(STORAGE_NAME, attach=True)
+    harness.begin()
+
+    database_path = Path(harness.model.storages[STORAGE_NAME][0].location) / SQLITE_DATABASE_FILE
+    with closing(sqlite3.connect(database_path)) as connection:
+        connection.execute("CREATE TABLE Artifact (id INTEGER PRIMARY KEY)")
+        connection.executemany("INSERT INTO Artifact VALUES (?)", [(i,) for i in range(100)])
+        connection.commit()
+    backup_path = tmp_path / "backup" / "mlmd.db"
+
+    results = harness.run_action("backup-db", {"path": str(backup_path)}).results
+
+    assert results["path"] == str(backup_path)
+    assert results["bytes"] == backup_path.stat().st_size
+    assert results["throughput-bytes-per-second"] > 0
+    assert not backup_path.with_name("mlmd.db.partial").exists()
+    with closing(sqlite3.connect(backup_path)) as connection:
+        assert connection.execute("SELECT COUNT(*) FROM Artifact").fetchone() == (100,)
+
+
+def test_backup_db_action_completes_under_concurrent_writes(
+    harness, mocked_lightkube_client, tmp_path
+):
+    """Test that backup-db completes while another connection keeps committing writes."""
+    harness.set_leader(True)
+    harness.add_storage(STORAGE_NAME, attach=True)
+    harness.begin()
+
+    database_path = Path(harness.model.storages[STORAGE_NAME][0].location) / SQLITE_DATABASE_FILE
+    with closing(sqlite3.connect(database_path)) as connection:
+        connection.execute("PRAGMA journal_mode=wal")
+        connection.execute("CREATE TABLE Artifact (id INTEGER PRIMARY KEY, data BLOB)")
+        connection.executemany(
+            "INSERT INTO Artifact (data) VALUES (?)", [(b"x" * 4096,) for _ in range(500)]
+        )
+        connection.commit()
+
+    stop = threading.Event()
+
+    def write_continuously():
+        with closing(sqlite3.connect(database_path, timeout=5)) as connection:
+            while not stop.is_set():
+                connection.execute("INSERT INTO Artifact (data) VALUES (x'00')")
+                connection.commit()
+
+    writer = threading.Thread(target=write_continuously)
+    writer.start()
+    try:
+        results = harness.run_action("backup-db", {"path": str(tmp_path / "mlmd.db")}).results
+    finally:
+        stop.set()
+        writer.join()
+
+    with closing(sqlite3.connect(results["path"])) as connection:
+        assert connection.execute("PRAGMA integrity_check").fetchone() == ("ok",)
+        (count,) = connection.execute("SELECT COUNT(*) FROM Artifact").fetchone()
+    assert count >= 500
+
+
+def test_backup_db_action_requires_path(harness, mocked_lightkube_client):
+    """Test that backup-db does not pick a destination, so it never fills the storage."""
+    harness.set_leader(True)
+    harness.add_storage(STORAGE_NAME, attach=True)
+    harness.begin()
+
+    with pytest.raises(RuntimeError, match="'path' parameter is required"):
+        harness.run_action("backup-db")
+
+
+def test_backup_db_action_rejects_relative_path(harness, mocked_lightkube_client):
+    """Test that backup-db fails rather than write the backup relative to the charm directory."""
+    harness.set_leader(True)
+    harness.add_storage(STORAGE_NAME, attach=True)
+    harness.begin()
+    harness.charm.sqlite_store.component.backup = MagicMock()
+
+    with pytest.raises(ActionFailed, match="path must be absolute, got 'mlmd.db'"):
+        harness.run_action("backup-db", {"path": "mlmd.db"})
+
+    harness.charm.sqlite_store.component.backup.assert_not_called()
+
+
+def test_backup_db_action_fails_without_database(harness, mocked_lightkube_client, tmp_path):
+    """Test that backup-db fails before the server has created the database."""
+    harness.set_leader(True)
+    harness.add_storage(STORAGE_NAME, attach=True)
+    harness.begin()
+
+    with pytest.raises(ActionFailed, match="SQLite database not created yet"):
+        harness.run_action("backup-db", {"path": str(tmp_path / "mlmd.db")})
+
+
+def test_velero_backup_hook_checkpoints_database(harness, mocked_lightkube_client):
+    """Test that the pod is annotated with a pre-backup hook checkpointing the WAL."""
+    harness.set_leader(True)
+    harness.add_storage(STORAGE_NAME, attach=True)
+    harness.begin()
+    harness.set_can_connect(CONTAINER_NAME, True)
+    mocked_lightkube_client.get.return_value.metadata.annotations = {}
+
+    harness.charm.on.install.emit()
+
+    mocked_lightkube_client.patch.assert_called_once()
+    assert mocked_lightkube_client.patch.call_args.kwargs["name"] == "mlmd-0"
+    annotations = mocked_lightkube_client.patch.call_args.kwargs["obj"]["metadata"]["annotations"]
+    assert annotations["pre.hook.backup.velero.io/container"] == "charm"
+    assert annotations["pre.hook.backup.velero.io/on-error"] == "Fail"
+
+    # Run the hook against a database with pending WAL frames
+    database_path = Path(harness.model.storages[STORAGE_NAME][0].location) / SQLITE_DATABASE_FILE
+    with closing(sqlite3.connect(database_path)) as connection:
+        connection.execute("PRAGMA journal_mode=wal")
+        connection.execute("CREATE TABLE Artifact (id INTEGER PRIMARY KEY)")
+        connection.commit()
+        command = json.loads(annotations["pre.hook.backup.velero.io/command"])
+        assert command[0] == "python3"
+        subprocess.run([sys.executable, *command[1:]], check=True)
+        assert database_path.with_name(f"{SQLITE_DATABASE_FILE}-wal").stat().st_size == 0
+
+
+@requires_root
+def test_velero_backup_hook_checkpoints_database_of_workload_user(
+    harness, mocked_lightkube_client
+):
+    """Test that the hook checkpoints, as the charm user, the WAL the workload user wrote."""
+    harness.set_leader(True)
+    harness.update_config({"sqlite-journal-mode": "wal"})
+    harness.add_storage(STORAGE_NAME, attach=True)
+    harness.begin()
+    harness.set_can_connect(CONTAINER_NAME, True)
+    harness.handle_exec(CONTAINER_NAME, ["chgrp"], handler=_exec_as_workload_user)
+    harness.handle_exec(CONTAINER_NAME, ["chmod"], handler=_exec_as_workload_user)
+    database_path = _create_workload_database(
+        harness, "CREATE TABLE Artifact (id INTEGER PRIMARY KEY);"
+    )
+    component = harness.charm.sqlite_store.component
+    with _as_user(CHARM_UID, [CHARM_UID]):
+        component.configure_charm(None)
+    command = harness.charm.velero_backup_hooks.component.get_annotations()[
+        "pre.hook.backup.velero.io/command"
+    ]
+
+    with _as_user(WORKLOAD_UID, [WORKLOAD_UID, CHARM_UID]):
+        workload_connection = sqlite3.connect(database_path)
+        workload_connection.execute("INSERT INTO Artifact VALUES (1)")
+        workload_connection.commit()
+    with closing(workload_connection):
+        # The hook script, as the charm container runs it
+        hook_namespace = {}
+        with _as_user(CHARM_UID, [CHARM_UID]), pytest.raises(SystemExit) as hook_exit:
+            exec(json.loads(command)[2], hook_namespace)
+        hook_namespace["connection"].close()
+
+        assert hook_exit.value.code == 0
+        assert database_path.with_name(f"{SQLITE_DATABASE_FILE}-wal").stat().st_size == 0
+
+
+def test_velero_backup_hook_not_patched_when_unchanged(harness, mocked_lightkube_client):
+    """Test that the pod is not patched when it already has the backup hook annotations."""
+    harness.set_leader(True)
+    harness.add_storage(STORAGE_NAME, attach=True)
+    harness.begin()
+    harness.set_can_connect(CONTAINER_NAME, True)
+    mocked_lightkube_client.get.return_value.metadata.annotations = (
+        harness.charm.velero_backup_hooks.component.get_annotations()
+    )
+
+    harness.charm.on.install.emit()
+
+    mocked_lightkube_client.patch.assert_not_called()
+
+
+def test_velero_backup_hook_pod_read_once_while_unchanged(harness, mocked_lightkube_client):
+    """Test that the pod is neither read nor patched again while the annotations are unchanged."""
+    harness.set_leader(True)
+    harness.add_storage(STORAGE_NAME, attach=True)
+    harness.begin()
+    harness.set_can_connect(CONTAINER_NAME, True)
+    mocked_lightkube_client.get.return_value.metadata.annotations = {}
+
+    harness.charm.on.install.emit()
+    harness.charm.on.update_status.emit()
+
+    pod_gets = [call for call in mocked_lightkube_client.get.call_args_list if call.args[0] is Pod]
+    assert len(pod_gets) == 1
+    mocked_lightkube_client.patch.assert_called_once()
+
+
+def test_velero_backup_hook_pod_patched_again_after_failure(harness, mocked_lightkube_client):
+    """Test that a failed patch is retried on the next event."""
+    harness.set_leader(True)
+    harness.add_storage(STORAGE_NAME, attach=True)
+    harness.begin()
+    harness.set_can_connect(CONTAINER_NAME, True)
+    mocked_lightkube_client.get.return_value.metadata.annotations = {}
+    mocked_lightkube_client.patch.side_effect = [
+        ApiError(status=Status(code=500, message="Internal Server Error")),
+        None,
+    ]
+
+    harness.charm.on.install.emit()
+    harness.charm.on.update_status.emit()
+
+    assert mocked_lightkube_client.patch.call_count == 2
+
+
+def test_velero_backup_spec_includes_pods(harness, mocked_lightkube_client):
+    """Test that the backup includes the pod, so Velero runs its pre-backup hook."""
+    harness.set_leader(True)
+    harness.begin()
+
+    relation_id = harness.add_relation("velero-backup-config", "velero-operator")
+
+    spec = json.loads(harness.get_relation_data(relation_id, harness.charm.app)["spec"])
+    assert spec["include_namespaces"] == [harness.model.name]
+    assert {"pods", "persistentvolumeclaims", "persistentvolumes"} <= set(
+        spec["include_resources"]
+    )
+    assert spec["label_selector"] == {"app.kubernetes.io/name": harness.charm.app.name}
+
+
+def test_velero_backup_hook_removed_with_external_database(harness, mocked_lightkube_client):
+    """Test that the backup hook is removed from the pod when SQLite is not in use."""
+    harness.set_leader(True)
+    harness.add_storage(STORAGE_NAME, attach=True)
+    harness.begin()
+    harness.set_can_connect(CONTAINER_NAME, True)
+    mocked_lightkube_client.get.return_value.metadata.annotations = {
+        "pre.hook.backup.velero.io/container": "charm"
+    }
+    harness.add_relation(
+        MYSQL_RELATION_NAME,
+        "mysql-k8s",
+        app_data={"endpoints": "mysql:3306", "username": "user", "password": "secret"},
+    )
+
+    harness.charm.on.install.emit()
+
+    annotations = mocked_lightkube_client.patch.call_args.kwargs["obj"]["metadata"]["annotations"]
+    assert set(annotations.values()) == {None}
+
+
+def _create_database_with_free_pages(database_path: Path, auto_vacuum: str = "none"):
+    """Creates a database where deleted rows left free pages behind."""
+    with closing(sqlite3.connect(database_path)) as connection:
+        connection.execute(f"PRAGMA auto_vacuum={auto_vacuum}")
+        connection.executescript(MLMD_SCHEMA)
+        connection.executemany(
+            "INSERT INTO ArtifactProperty VALUES (?)", [(b"x" * 4096,) for _ in range(50)]
+        )
+        connection.commit()
+        connection.execute("DELETE FROM ArtifactProperty")
+        connection.commit()
+        (freelist_count,) = connection.execute("PRAGMA freelist_count").fetchone()
+    assert freelist_count > 0
+    return freelist_count
+
+
+def test_optimize_db_action_reclaims_pages_incrementally(harness, mocked_lightkube_client):
+    """Test that optimize-db reclaims free pages in slices when incremental vacuum is enabled."""
+    harness.set_leader(True)
+    harness.add_storage(STORAGE_NAME, attach=True)
+    harness.begin()
+    database_path = Path(harness.model.storages[STORAGE_NAME][0].location) / SQLITE_DATABASE_FILE
+    freelist_count = _create_database_with_free_pages(database_path, auto_vacuum="incremental")
+
+    with patch("components.sqlite_components.time.sleep") as mocked_sleep:
+        results = harness.run_action(
+            "optimize-db", {"max-pages": 10, "batch-interval": 0.5}
+        ).results
+
+    assert results["incremental-vacuum"] == "enabled"
+    # ANALYZE may take a free page for its statistics table
+    assert results["pages-reclaimed"] >= freelist_count - 1
+    assert results["freelist-count"] == 0
+    assert "probe-latency-ms-before" in results and "probe-latency-ms-after" in results
+    # Pages are reclaimed 10 at a time, pausing after each slice
+    assert mocked_sleep.call_count >= (freelist_count - 1) // 10
+
+
+def test_optimize_db_action_full_vacuum(harness, mocked_lightkube_client):
+    """Test that optimize-db only reclaims pages of a database without auto-vacuum if asked."""
+    harness.set_leader(True)
+    harness.add_storage(STORAGE_NAME, attach=True)
+    harness.begin()
+    database_path = Path(harness.model.storages[STORAGE_NAME][0].location) / SQLITE_DATABASE_FILE
+    freelist_count = _create_database_with_free_pages(database_path)
+
+    results = harness.run_action("optimize-db").results
+    assert results["incremental-vacuum"] == "disabled"
+    assert results["freelist-count"] >= freelist_count - 1
+
+    results = harness.run_action("optimize-db", {"full-vacuum": True}).results
+    assert results["incremental-vacuum"] == "enabled"
+    assert results["pages-reclaimed"] > 0
+    assert results["freelist-count"] == 0
+
+
+def test_optimize_db_action_counts_only_reclaimed_pages(harness, mocked_lightkube_client):
+    """Test that pages the server allocates during the maintenance are not counted."""
+    harness.set_leader(True)
+    harness.add_storage(STORAGE_NAME, attach=True)
+    harness.begin()
+    database_path = Path(harness.model.storages[STORAGE_NAME][0].location) / SQLITE_DATABASE_FILE
+    freelist_count = _create_database_with_free_pages(database_path, auto_vacuum="incremental")
+
+    def write_between_batches(_):
+        with closing(sqlite3.connect(database_path)) as connection:
+            connection.execute("INSERT INTO ArtifactProperty VALUES (zeroblob(65536))")
+            connection.commit()
+
+    with patch("components.sqlite_components.time.sleep", side_effect=write_between_batches):
+        results = harness.run_action("optimize-db", {"max-pages": 5}).results
+
+    assert 0 < results["pages-reclaimed"] <= freelist_count
+
+
+def test_optimize_db_action_measures_on_fresh_connections(harness, mocked_lightkube_client):
+    """Test that the probe queries run on their own connection before and after maintenance."""
+    harness.set_leader(True)
+    harness.add_storage(STORAGE_NAME, attach=True)
+    harness.begin()
+    database_path = Path(harness.model.storages[STORAGE_NAME][0].location) / SQLITE_DATABASE_FILE
+    _create_database_with_free_pages(database_path)
+
+    with patch(
+        "components.sqlite_components._measure", return_value=(1, 0, 1.0)
+    ) as mocked_measure:
+        harness.run_action("optimize-db")
+
+    assert [call.args for call in mocked_measure.call_args_list] == [(database_path,)] * 2
+
+
+@pytest.mark.parametrize(
+    "window, expected_runs",
+    [("02:00-04:00", 1), ("23:00-03:30", 1), ("04:00-05:00", 0), ("", 0)],
+)
+def test_sqlite_maintenance_runs_once_in_window(
+    harness, mocked_lightkube_client, window, expected_runs
+):
+    """Test that the scheduled maintenance only runs in its window and once a day."""
+    harness.set_leader(True)
+    harness.update_config({"sqlite-maintenance-window": window})
+    harness.add_storage(STORAGE_NAME, attach=True)
+    harness.begin()
+    harness.set_can_connect(CONTAINER_NAME, True)
+    harness.charm.kubernetes_resources.get_status = MagicMock(return_value=ActiveStatus())
+    database_path = Path(harness.model.storages[STORAGE_NAME][0].location) / SQLITE_DATABASE_FILE
+    _create_database_with_free_pages(database_path)
+    harness.charm.sqlite_store.component.optimize = MagicMock(return_value={})
+
+    # 2026-01-01 03:00 UTC, then 10 minutes later
+    with patch("components.sqlite_components.time.time", return_value=1767236400) as mocked_time:
+        harness.charm.on.update_status.emit()
+        mocked_time.return_value += 600
+        harness.charm.on.update_status.emit()
+
+    assert harness.charm.sqlite_store.component.optimize.call_count == expected_runs
+    if expected_runs:
+        max_duration = harness.charm.sqlite_store.component.optimize.call_args.kwargs[
+            "max_duration"
+        ]
+        assert max_duration <= 10
+
+
+def test_sqlite_maintenance_failure_blocks_until_optimized(harness, mocked_lightkube_client):
+    """Test that a failed scheduled maintenance blocks the unit and is not retried at once."""
+    harness.set_leader(True)
+    harness.update_config({"sqlite-maintenance-window": "00:00-23:59"})
+    harness.add_storage(STORAGE_NAME, attach=True)
+    harness.begin()
+    harness.set_can_connect(CONTAINER_NAME, True)
+    harness.charm.kubernetes_resources.get_status = MagicMock(return_value=ActiveStatus())
+    database_path = Path(harness.model.storages[STORAGE_NAME][0].location) / SQLITE_DATABASE_FILE
+    _create_database_with_free_pages(database_path)
+    component = harness.charm.sqlite_store.component
+
+    with patch.object(
+        component, "optimize", side_effect=SqliteStoreError("database is locked")
+    ) as mocked_optimize:
+        harness.charm.on.update_status.emit()
+        harness.charm.on.update_status.emit()
+
+    mocked_optimize.assert_called_once()
+    assert harness.charm.unit.status == BlockedStatus(
+        "[sqlite-store] Scheduled SQLite maintenance failed, see the logs or run optimize-db"
+    )
+
+    harness.run_action("optimize-db")
+    harness.charm.on.update_status.emit()
+
+    assert harness.charm.unit.status == ActiveStatus()
+
+
+def test_sqlite_maintenance_not_run_before_workload_active(harness, mocked_lightkube_client):
+    """Test that the scheduled maintenance waits for the workload, as part of the reconcile."""
+    harness.set_leader(True)
+    harness.update_config({"sqlite-maintenance-window": "00:00-23:59"})
+    harness.add_storage(STORAGE_NAME, attach=True)
+    harness.begin()
+    database_path = Path(harness.model.storages[STORAGE_NAME][0].location) / SQLITE_DATABASE_FILE
+    _create_database_with_free_pages(database_path)
+    harness.charm.sqlite_store.component.optimize = MagicMock(return_value={})
+
+    harness.charm.on.update_status.emit()
+
+    harness.charm.sqlite_store.component.optimize.assert_not_called()
+
+
+def test_sqlite_maintenance_collects_garbage_with_retention(harness, mocked_lightkube_client):
+    """Test that the scheduled maintenance collects garbage with a bounded duration."""
+    harness.set_leader(True)
+    harness.update_config(
+        {"sqlite-maintenance-window": "00:00-23:59", "sqlite-retention-days": 30}
+    )
+    harness.add_storage(STORAGE_NAME, attach=True)
+    harness.begin()
+    harness.set_can_connect(CONTAINER_NAME, True)
+    harness.charm.kubernetes_resources.get_status = MagicMock(return_value=ActiveStatus())
+    database_path = Path(harness.model.storages[STORAGE_NAME][0].location) / SQLITE_DATABASE_FILE
+    _create_database_with_free_pages(database_path)
+    component = harness.charm.sqlite_store.component
+    component.collect_garbage = MagicMock(return_value={})
+    component.optimize = MagicMock(return_value={})
+
+    harness.charm.on.update_status.emit()
+
+    component.collect_garbage.assert_called_once()
+    assert component.collect_garbage.call_args.kwargs["retention_days"] == 30
+    assert component.collect_garbage.call_args.kwargs["max_duration"] <= 10
+    component.optimize.assert_called_once()
+
+
+def test_collect_garbage_stops_at_deadline(harness, mocked_lightkube_client):
+    """Test that garbage collection deletes no more batches once max_duration has passed."""
+    harness.set_leader(True)
+    harness.add_storage(STORAGE_NAME, attach=True)
+    harness.begin()
+    database_path = Path(harness.model.storages[STORAGE_NAME][0].location) / SQLITE_DATABASE_FILE
+    with closing(sqlite3.connect(database_path)) as connection:
+        connection.executescript(MLMD_SCHEMA)
+        connection.executemany("INSERT INTO Execution VALUES (?, 0)", [(1,), (2,), (3,)])
+        connection.commit()
+    component = harness.charm.sqlite_store.component
+
+    # The deadline passes during the first batch
+    with patch("components.sqlite_components.time.monotonic", side_effect=[0, 0, 1, 1, 1, 1]):
+        deleted = component.collect_garbage(
+            retention_days=1, batch_size=1, batch_interval=0, max_duration=0.5
+        )
+
+    assert deleted == {"executions": 1, "artifacts": 0, "contexts": 0}
+    with closing(sqlite3.connect(database_path)) as connection:
+        assert connection.execute("SELECT COUNT(*) FROM Execution").fetchone() == (2,)
+
+
+def test_sqlite_maintenance_window_invalid(harness, mocked_lightkube_client):
+    """Test that an invalid maintenance window blocks the charm."""
+    harness.set_leader(True)
+    harness.update_config({"sqlite-maintenance-window": "2am-4am"})
+    harness.begin()
+    harness.set_can_connect(CONTAINER_NAME, True)
+    harness.charm.kubernetes_resources.get_status = MagicMock(return_value=ActiveStatus())
+
+    harness.charm.on.install.emit()
+
+    assert harness.charm.unit.status == BlockedStatus(
+        "[sqlite-store] Invalid sqlite-maintenance-window '2am-4am', expected HH:MM-HH:MM"
+    )
+
+
+def test_grpc_channel_args_merged_into_command(harness, mocked_lightkube_client):
+    """Test that configured gRPC channel arguments override and extend the defaults."""
+    harness.set_leader(True)
+    harness.update_config(
+        {"grpc-channel-args": "grpc.max_concurrent_streams=1000, grpc.max_metadata_size=32768"}
+    )
+    harness.begin()
+    harness.set_can_connect(CONTAINER_NAME, True)
+    harness.charm.kubernetes_resources.get_status = MagicMock(return_value=ActiveStatus())
+
+    harness.charm.on.install.emit()
+
+    command = harness.get_container_pebble_plan(CONTAINER_NAME).services[SERVICE_NAME].command
+    assert command.endswith(
+        " --grpc_channel_arguments=grpc.max_metadata_size=32768,"
+        "grpc.max_receive_message_length=104857600,"
+        "grpc.max_send_message_length=104857600,"
+        "grpc.max_concurrent_streams=1000"
+    )
+    assert isinstance(harness.charm.unit.status, ActiveStatus)
+
+
+@pytest.mark.parametrize(
+    "grpc_channel_args, expected_message",
+    [
+        ("grpc.unknown=1", "Invalid gRPC channel argument 'grpc.unknown=1'"),
+        ("grpc.keepalive_time_ms", "Invalid gRPC channel argument 'grpc.keepalive_time_ms'"),
+        (
+            "grpc.keepalive_time_ms=soon",
+            "gRPC channel argument grpc.keepalive_time_ms must be an integer, got 'soon'",
+        ),
+    ],
+)
+def test_grpc_channel_args_invalid(
+    grpc_channel_args, expected_message, harness, mocked_lightkube_client
+):
+    """Test that invalid gRPC channel arguments block the charm."""
+    harness.set_leader(True)
+    harness.update_config({"grpc-channel-args": grpc_channel_args})
+    harness.begin()
+    harness.set_can_connect(CONTAINER_NAME, True)
+    harness.charm.kubernetes_resources.get_status = MagicMock(return_value=ActiveStatus())
+
+    harness.charm.on.install.emit()
+
+    assert harness.charm.unit.status == BlockedStatus(f"[mlmd-grpc-service] {expected_message}")
+
+
+def test_pebble_layer_health_checks(harness, mocked_lightkube_client):
+    """Test that the layer restarts the service on a failing alive check with the set backoff."""
+    harness.set_leader(True)
+    harness.update_config({"restart-backoff-delay": "1s", "restart-backoff-limit": "10s"})
+    harness.begin()
+    harness.set_can_connect(CONTAINER_NAME, True)
+    harness.charm.kubernetes_resources.get_status = MagicMock(return_value=ActiveStatus())
+
+    harness.charm.on.install.emit()
+
+    plan = harness.get_container_pebble_plan(CONTAINER_NAME)
+    service = plan.services[SERVICE_NAME]
+    assert service.on_check_failure == {f"{SERVICE_NAME}-alive": "restart"}
+    assert service.backoff_delay == "1s"
+    assert service.backoff_factor == 2.0
+    assert service.backoff_limit == "10s"
+    assert plan.checks[f"{SERVICE_NAME}-ready"].level == CheckLevel.READY
+    assert plan.checks[f"{SERVICE_NAME}-ready"].tcp == {"port": 8080}
+    assert plan.checks[f"{SERVICE_NAME}-alive"].level == CheckLevel.ALIVE
+    assert plan.checks[f"{SERVICE_NAME}-alive"].tcp == {"port": 8080}
+
+
+def test_pebble_ready_check_failing(harness, mocked_lightkube_client):
+    """Test that the charm waits while the ready check of the service is failing."""
+    harness.set_leader(True)
+    harness.begin()
+    harness.set_can_connect(CONTAINER_NAME, True)
+    harness.charm.kubernetes_resources.get_status = MagicMock(return_value=ActiveStatus())
+    harness.charm.on.install.emit()
+
+    failing_check = CheckInfo(
+        name=f"{SERVICE_NAME}-ready", level=CheckLevel.READY, status=CheckStatus.DOWN
+    )
+    with patch("ops.model.Container.get_checks", return_value={failing_check.name: failing_check}):
+        assert harness.charm.mlmd_container.component.get_status() == WaitingStatus(
+            f"Pebble check {SERVICE_NAME}-ready is failing, the unit is not ready"
+        )
+
+
+def test_restart_backoff_invalid(harness, mocked_lightkube_client):
+    """Test that an invalid restart backoff blocks the charm."""
+    harness.set_leader(True)
+    harness.update_config({"restart-backoff-delay": "soon"})
+    harness.begin()
+    harness.set_can_connect(CONTAINER_NAME, True)
+    harness.charm.kubernetes_resources.get_status = MagicMock(return_value=ActiveStatus())
+
+    harness.charm.on.install.emit()
+
+    assert harness.charm.unit.status == BlockedStatus(
+        "[mlmd-grpc-service] Invalid restart-backoff-delay 'soon', expected a duration like"
+        " 500ms or 1m30s"
+    )
+
+
+def test_unrelated_events_do_not_restart_server(harness, mocked_lightkube_client):
+    """Test that events that do not change the layer or config.proto do not bounce the server."""
+    harness.set_leader(True)
+    harness.begin()
+    harness.set_can_connect(CONTAINER_NAME, True)
+    harness.charm.kubernetes_resources.get_status = MagicMock(return_value=ActiveStatus())
+    harness.charm.on.install.emit()
+
+    with (
+        patch("ops.model.Container.push") as mocked_push,
+        patch("ops.model.Container.replan") as mocked_replan,
+    ):
+        rel_id = harness.add_relation("logging", "loki-k8s")
+        harness.add_relation_unit(rel_id, "loki-k8s/0")
+        harness.update_relation_data(
+            rel_id, "loki-k8s/0", {"endpoint": '{"url": "http://loki:3100/push"}'}
+        )
+        harness.charm.on.update_status.emit()
+        harness.charm.on.config_changed.emit()
+
+        mocked_push.assert_not_called()
+        mocked_replan.assert_not_called()
+    assert harness.charm.unit.get_container(CONTAINER_NAME).get_service(SERVICE_NAME).is_running()
+
+
+def test_unchanged_layer_detected_from_pebble_normalized_plan(harness, mocked_lightkube_client):
+    """Test that the layer is seen as unchanged when Pebble returns normalized plan values."""
+    harness.set_leader(True)
+    harness.update_config({"restart-backoff-limit": "90s"})
+    harness.begin()
+    harness.set_can_connect(CONTAINER_NAME, True)
+    harness.charm.kubernetes_resources.get_status = MagicMock(return_value=ActiveStatus())
+    harness.charm.on.install.emit()
+
+    # Pebble returns floats without decimals and durations in their canonical form
+    plan_yaml = harness.get_container_pebble_plan(CONTAINER_NAME).to_yaml()
+    pebble_plan_yaml = plan_yaml.replace("backoff-factor: 2.0", "backoff-factor: 2").replace(
+        "backoff-limit: 90s", "backoff-limit: 1m30s"
+    )
+    assert pebble_plan_yaml != plan_yaml
+
+    with (
+        patch("ops.model.Container.get_plan", return_value=Plan(pebble_plan_yaml)),
+        patch("ops.model.Container.push") as mocked_push,
+        patch("ops.model.Container.replan") as mocked_replan,
+    ):
+        harness.charm.on.config_changed.emit()
+
+        mocked_push.assert_not_called()
+        mocked_replan.assert_not_called()
+
+
+def test_config_proto_pushed_only_when_changed_with_pebble_plan(harness, mocked_lightkube_client):
+    """Test that config.proto is pushed once when it changes, given the plan Pebble returns."""
+    harness.set_leader(True)
+    harness.begin()
+    harness.set_can_connect(CONTAINER_NAME, True)
+    harness.charm.kubernetes_resources.get_status = MagicMock(return_value=ActiveStatus())
+    harness.charm.on.install.emit()
+
+    with patch(
+        "ops.model.Container.push", wraps=harness.charm.unit.get_container(CONTAINER_NAME).push
+    ) as mocked_push:
+        # The plan read back from Pebble, with its floats written without decimals
+        with patch(
+            "ops.model.Container.get_plan",
+            side_effect=lambda: Plan(
+                harness.get_container_pebble_plan(CONTAINER_NAME)
+                .to_yaml()
+                .replace("backoff-factor: 2.0", "backoff-factor: 2")
+            ),
+        ):
+            harness.add_relation(
+                MYSQL_RELATION_NAME,
+                "mysql-k8s",
+                app_data={"endpoints": "mysql:3306", "username": "user", "password": "secret"},
+            )
+            harness.charm.on.config_changed.emit()
+            harness.charm.on.update_status.emit()
+
+        assert mocked_push.call_count == 1
+    config_proto = harness.charm.unit.get_container(CONTAINER_NAME).pull(CONFIG_PROTO_DESTINATION)
+    assert "mysql" in config_proto.read()
+
+
+def test_config_proto_change_restarts_server(harness, mocked_lightkube_client):
+    """Test that a change in the rendered config.proto replans the server."""
+    harness.set_leader(True)
+    harness.begin()
+    harness.set_can_connect(CONTAINER_NAME, True)
+    harness.charm.kubernetes_resources.get_status = MagicMock(return_value=ActiveStatus())
+    harness.charm.on.install.emit()
+    environment = (
+        harness.get_container_pebble_plan(CONTAINER_NAME).services[SERVICE_NAME].environment
+    )
+
+    with patch("ops.model.Container.replan") as mocked_replan:
+        harness.add_relation(
+            MYSQL_RELATION_NAME,
+            "mysql-k8s",
+            app_data={"endpoints": "mysql:3306", "username": "user", "password": "secret"},
+        )
+        harness.charm.on.config_changed.emit()
+
+        mocked_replan.assert_called_once()
+    plan = harness.get_container_pebble_plan(CONTAINER_NAME)
+    assert plan.services[SERVICE_NAME].environment != environment
+
+
 @pytest.fixture()
-def harness(mocked_kubernetes_service_patch):
+def harness():
     harness = Harness(Operator)
     harness.set_model_name(MODEL_NAME)
     yield harness
     harness.cleanup()
 
 
-@pytest.fixture()
-def mocked_kubernetes_service_patch(mocker):
-    """Mocks the KubernetesServicePatch for the charm."""
-    mocked_kubernetes_service_patch = mocker.patch(
-        "charm.KubernetesServicePatch", lambda *_, **__: None
-    )
-    yield mocked_kubernetes_service_patch
-
-
 @pytest.fixture()
 def mocked_lightkube_client(mocker):
     """Mocks the Lightkube Client in charm.py, returning a mock instead."""